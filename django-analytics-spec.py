@@ -0,0 +1,690 @@
+# Spécifications du moteur d'analytics Django pour SubChain
+# À utiliser comme référence pour les calculs de métriques côté backend
+
+"""
+# analytics.py
+
+from datetime import timedelta
+from decimal import Decimal
+from django.db.models import Case, Count, DecimalField, F, Func, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .ledger import merchant_revenue
+from .models import Subscriber
+
+MONEY = DecimalField(max_digits=20, decimal_places=6)
+ZERO = Value(Decimal('0'), output_field=MONEY)
+
+class PerMonth(Func):
+    # Yearly amount / 12 without truncation: SQLite casts whole-number decimals (and a '12' parameter)
+    # to INTEGER, so the divisor there has to be a REAL literal
+    arity = 1
+    template = '(%(expressions)s / 12)'
+    output_field = MONEY
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sqlite(compiler, connection, template='(%(expressions)s / 12.0)', **extra_context)
+
+def monthly_amount(prefix='plan__'):
+    # Monthly-normalised price of the plan behind a row (yearly plans / 12)
+    return Case(
+        When(**{f'{prefix}interval': 'monthly'}, then=F(f'{prefix}amount')),
+        When(**{f'{prefix}interval': 'yearly'}, then=PerMonth(f'{prefix}amount')),
+        default=ZERO,
+        output_field=MONEY,
+    )
+
+def subscriber_metrics(user, now=None):
+    # One grouped query: status breakdown, 30-day churn and MRR for every plan at once
+    now = now or timezone.now()
+    thirty_days_ago = now - timedelta(days=30)
+
+    return Subscriber.objects.filter(plan__user=user).aggregate(
+        total_subscribers=Count('id'),
+        active_subscribers=Count('id', filter=Q(status='active')),
+        cancelled_subscribers=Count('id', filter=Q(status='cancelled')),
+        paused_subscribers=Count('id', filter=Q(status='paused')),
+        past_due_subscribers=Count('id', filter=Q(status='past_due')),
+        churned_last_month=Count(
+            'id', filter=Q(status='cancelled', updated_at__gte=thirty_days_ago)
+        ),
+        mrr=Coalesce(Sum(monthly_amount(), filter=Q(status='active')), ZERO),
+    )
+
+def revenue_metrics(user):
+    # From the payment ledger rather than Payment, which loses rows to archive.py
+    return {'total_revenue': merchant_revenue(getattr(user, 'pk', user))}
+"""
+
+"""
+# rollups.py
+
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .analytics import revenue_metrics, subscriber_metrics
+from .asyncdb import gather_queries
+from .cache import invalidate_on_commit
+from .ledger import merchant_revenue
+from .models import DailyMetricsSnapshot
+
+# Carried forward from the previous day when a new row is opened
+STATE_FIELDS = [
+    'mrr', 'total_subscribers', 'active_subscribers', 'cancelled_subscribers',
+    'paused_subscribers', 'past_due_subscribers', 'cumulative_revenue',
+]
+# Reset to zero every day
+FLOW_FIELDS = ['new_subscribers', 'churned_subscribers', 'revenue']
+
+STATUS_FIELDS = {
+    'active': 'active_subscribers',
+    'cancelled': 'cancelled_subscribers',
+    'paused': 'paused_subscribers',
+    'past_due': 'past_due_subscribers',
+}
+
+# Smallest difference the snapshot's decimal columns can store
+RESOLUTION = Decimal('0.000001')
+
+def monthly_price(amount, interval):
+    return amount / 12 if interval == 'yearly' else amount
+
+def plan_monthly_amount(plan):
+    return monthly_price(plan.amount, plan.interval)
+
+def state_from_source(user_id):
+    # One-off backfill for merchants that have no snapshot yet
+    subscribers = subscriber_metrics(user_id)
+    state = {field: subscribers[field] for field in STATUS_FIELDS.values()}
+    state.update(
+        mrr=subscribers['mrr'],
+        total_subscribers=subscribers['total_subscribers'],
+        cumulative_revenue=revenue_metrics(user_id)['total_revenue'],
+    )
+    return state
+
+def ensure_snapshot(user_id, day):
+    # Returns (snapshot, backfilled); a backfilled row already reflects the current state
+    snapshot = DailyMetricsSnapshot.objects.filter(user_id=user_id, date=day).first()
+    if snapshot is not None:
+        return snapshot, False
+
+    previous = (
+        DailyMetricsSnapshot.objects.filter(user_id=user_id, date__lt=day)
+        .order_by('-date')
+        .first()
+    )
+    if previous is None:
+        state, backfilled = state_from_source(user_id), True
+    else:
+        state, backfilled = {field: getattr(previous, field) for field in STATE_FIELDS}, False
+
+    try:
+        with transaction.atomic():
+            snapshot = DailyMetricsSnapshot.objects.create(user_id=user_id, date=day, **state)
+        return snapshot, backfilled
+    except IntegrityError:
+        # Another worker opened the day first
+        return DailyMetricsSnapshot.objects.get(user_id=user_id, date=day), False
+
+def apply_delta(user_id, day=None, **deltas):
+    # Incremental refresh: one UPDATE ... SET col = col + delta on the day's row
+    day = day or timezone.localdate()
+    _, backfilled = ensure_snapshot(user_id, day)
+    changes = {
+        field: F(field) + value
+        for field, value in deltas.items()
+        if value and not (backfilled and field in STATE_FIELDS)
+    }
+    if changes:
+        DailyMetricsSnapshot.objects.filter(user_id=user_id, date=day).update(
+            updated_at=timezone.now(), **changes
+        )
+
+def status_deltas(status, monthly_amount, sign):
+    deltas = {STATUS_FIELDS[status]: sign}
+    if status == 'active':
+        deltas['mrr'] = monthly_amount * sign
+    return deltas
+
+def record_subscriber_change(subscriber, old_status, new_status, old_plan=None):
+    # old_status is None for a new subscriber, new_status is None for a deletion; old_plan is
+    # the plan the subscriber was loaded with when it has moved to another one
+    plan = subscriber.plan
+    old_plan = old_plan or plan
+    if old_status == new_status and old_plan.pk == plan.pk:
+        return
+
+    # A move between two merchants' plans changes both merchants' rows
+    deltas = defaultdict(Counter)
+    if old_status is None:
+        deltas[plan.user_id].update(new_subscribers=1)
+    else:
+        deltas[old_plan.user_id].update(status_deltas(old_status, plan_monthly_amount(old_plan), -1))
+        deltas[old_plan.user_id].update(total_subscribers=-1)
+
+    if new_status is not None:
+        deltas[plan.user_id].update(status_deltas(new_status, plan_monthly_amount(plan), 1))
+        deltas[plan.user_id].update(total_subscribers=1)
+        if new_status == 'cancelled' and old_status != 'cancelled':
+            deltas[plan.user_id].update(churned_subscribers=1)
+
+    for user_id, user_deltas in deltas.items():
+        apply_delta(user_id, **user_deltas)
+
+def record_plan_price_change(plan, old_amount, old_interval):
+    # Every active subscriber of the plan now contributes the new monthly price
+    change = plan_monthly_amount(plan) - monthly_price(old_amount, old_interval)
+    if change:
+        active = plan.subscribers.filter(status='active').count()
+        apply_delta(plan.user_id, mrr=change * active)
+
+def record_payment_change(payment, old_status, new_status):
+    was_completed = old_status == 'completed'
+    is_completed = new_status == 'completed'
+    if was_completed == is_completed:
+        return
+
+    amount = payment.amount if is_completed else -payment.amount
+    apply_delta(payment.plan.user_id, revenue=amount, cumulative_revenue=amount)
+
+def reconcile_snapshots():
+    # Recompute today's state columns from the source tables and rewrite the rows that drifted:
+    # writes that bypass the signals (QuerySet.update(), bulk_create()) never reach
+    # apply_delta(). Each row is locked first, so transactions that already applied a delta
+    # have committed before the source is read, and later ones apply theirs on top of the
+    # rewritten values. Run periodically, like counters.reconcile_plan_counters().
+    today = timezone.localdate()
+    fixed = 0
+    user_ids = DailyMetricsSnapshot.objects.filter(date=today).values_list('user_id', flat=True)
+    for user_id in list(user_ids):
+        with transaction.atomic():
+            snapshot = DailyMetricsSnapshot.objects.select_for_update().get(user_id=user_id, date=today)
+            drifted = {
+                field: value
+                for field, value in state_from_source(user_id).items()
+                if abs(value - getattr(snapshot, field)) >= RESOLUTION
+            }
+            if drifted:
+                DailyMetricsSnapshot.objects.filter(pk=snapshot.pk).update(updated_at=timezone.now(), **drifted)
+                invalidate_on_commit([user_id])
+                fixed += 1
+    return fixed
+
+def today_snapshot(user_id, today):
+    return ensure_snapshot(user_id, today)[0]
+
+def churned_before_today(user_id, today):
+    # Today's churn comes from today_snapshot()
+    month_ago = today - timedelta(days=30)
+    return DailyMetricsSnapshot.objects.filter(
+        user_id=user_id, date__gt=month_ago, date__lt=today
+    ).aggregate(total=Coalesce(Sum('churned_subscribers'), 0))['total']
+
+def mrr_baseline(user_id, today):
+    return (
+        DailyMetricsSnapshot.objects.filter(user_id=user_id, date__lte=today - timedelta(days=30))
+        .order_by('-date')
+        .only('mrr')
+        .first()
+    )
+
+def ledger_revenue(user_id, today):
+    return merchant_revenue(user_id)
+
+# Independent reads behind the overview, next to today_snapshot(): run one after another by
+# overview_from_snapshots(), concurrently by aoverview_from_snapshots(). today_snapshot() is
+# not one of them, as opening the day's row may INSERT it and backfill from the source tables.
+OVERVIEW_QUERIES = (churned_before_today, mrr_baseline, ledger_revenue)
+
+def build_overview(snapshot, churned_before, baseline, total_revenue):
+    growth_rate = 0
+    if baseline is not None and baseline.mrr:
+        growth_rate = float((snapshot.mrr - baseline.mrr) / baseline.mrr * 100)
+
+    churned_last_month = churned_before + snapshot.churned_subscribers
+    churn_rate = (churned_last_month / max(snapshot.total_subscribers, 1)) * 100
+    arpu = total_revenue / max(snapshot.active_subscribers, 1)
+
+    return {
+        'total_subscribers': snapshot.total_subscribers,
+        'active_subscribers': snapshot.active_subscribers,
+        'cancelled_subscribers': snapshot.cancelled_subscribers,
+        'paused_subscribers': snapshot.paused_subscribers,
+        'mrr': float(snapshot.mrr),
+        'arr': float(snapshot.mrr * 12),
+        'churn_rate': churn_rate,
+        'total_revenue': float(total_revenue),
+        'average_revenue_per_user': float(arpu),
+        'growth_rate': growth_rate,
+    }
+
+def overview_from_snapshots(user_id, today=None):
+    # Constant number of queries: today's row, a 30-day churn sum, the baseline row and the
+    # ledger revenue (checkpoint + tail)
+    today = today or timezone.localdate()
+    snapshot = today_snapshot(user_id, today)
+    return build_overview(snapshot, *(query(user_id, today) for query in OVERVIEW_QUERIES))
+
+async def aoverview_from_snapshots(user_id, today=None):
+    # Today's row is opened first, on the request's own connection; the reads then run each on
+    # its own connection: the latency of the slowest, not of the sum
+    today = today or timezone.localdate()
+    snapshot = await sync_to_async(today_snapshot)(user_id, today)
+    reads = await gather_queries(*((query, user_id, today) for query in OVERVIEW_QUERIES))
+    return build_overview(snapshot, *reads)
+
+def metrics_timeseries(user_id, days, today=None):
+    # O(days): reads at most one row per day and fills gaps by carrying state forward
+    today = today or timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    ensure_snapshot(user_id, today)
+
+    rows = DailyMetricsSnapshot.objects.filter(
+        user_id=user_id, date__gte=start, date__lte=today
+    ).values('date', *STATE_FIELDS, *FLOW_FIELDS)
+    by_date = {row['date']: row for row in rows}
+
+    state = (
+        DailyMetricsSnapshot.objects.filter(user_id=user_id, date__lt=start)
+        .order_by('-date')
+        .values(*STATE_FIELDS)
+        .first()
+    ) or {field: 0 for field in STATE_FIELDS}
+
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = by_date.get(day)
+        if row is None:
+            row = {'date': day, **state, **{field: 0 for field in FLOW_FIELDS}}
+        else:
+            state = {field: row[field] for field in STATE_FIELDS}
+        series.append(row)
+
+    first_mrr, last_mrr = series[0]['mrr'], series[-1]['mrr']
+    growth_rate = float((last_mrr - first_mrr) / first_mrr * 100) if first_mrr else 0
+    return {'days': days, 'growth_rate': growth_rate, 'results': series}
+"""
+
+"""
+# cohorts.py
+
+# Cohort retention, MRR movement and churn. The merchant's history is pulled as a few
+# columnar arrays (one row per subscriber and month with revenue, grouped in SQL) and every
+# metric is computed with NumPy array operations; nothing loops over subscribers in Python.
+# Results are cached per merchant by the analytics response cache (see views.analytics_cohorts).
+#
+# A subscriber is active in a month when its net ledger revenue for that month is positive;
+# yearly payments count as amount / 12 for the twelve months they cover. The ledger keeps
+# archived and deleted payments, so the history stays complete.
+
+from dataclasses import dataclass
+from itertools import repeat
+from operator import itemgetter
+import numpy as np
+from django.db.models import CharField, Count, FloatField, Sum
+from django.db.models.functions import Cast, ExtractMonth, ExtractYear
+from django.utils import timezone
+from .models import PaymentLedgerEntry, SubscriptionPlan, Subscriber
+
+ROLLING_WINDOW = 3  # months
+
+def month_index(field):
+    return ExtractYear(field) * 12 + ExtractMonth(field) - 1
+
+def month_label(index):
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+@dataclass
+class CohortColumns:
+    # One row per (subscriber, month) with revenue, sorted by subscriber then month
+    subscriber: np.ndarray  # int64 subscriber index
+    month: np.ndarray  # int64 month index (year * 12 + month - 1)
+    cohort: np.ndarray  # int64 signup month index of the subscriber
+    plan: np.ndarray  # int64 index into plan_ids
+    amount: np.ndarray  # float64 net revenue
+    yearly: np.ndarray  # bool, the plan bills yearly
+    plan_ids: list
+    # Signups grouped by (month, plan), including subscribers that never paid
+    signup_month: np.ndarray
+    signup_plan: np.ndarray
+    signup_count: np.ndarray
+
+def column(rows, index, dtype):
+    return np.fromiter(map(itemgetter(index), rows), dtype=dtype, count=len(rows))
+
+def build_columns(plans, rows, signups):
+    # plans: (pk, interval); rows: (subscriber, plan, month, cohort, revenue) sorted by
+    # subscriber then month; signups: (month, plan, count). Each column is read straight
+    # into an array (map/fromiter, no per-row bytecode); see CohortLoadBenchmark
+    plan_ids = [str(pk) for pk, _ in plans]
+    plan_position = {plan_id: index for index, plan_id in enumerate(plan_ids)}
+    plan_yearly = np.array([interval == 'yearly' for _, interval in plans] + [False], dtype=bool)
+
+    def plan_column(rows, index):
+        # Unknown plans (deleted since) map to the extra last slot
+        keys = map(itemgetter(index), rows)
+        return np.fromiter(map(plan_position.get, keys, repeat(len(plan_ids))), dtype=np.int64, count=len(rows))
+
+    keys = column(rows, 0, object)
+    starts = np.r_[True, keys[1:] != keys[:-1]] if len(keys) else np.zeros(0, dtype=bool)
+    plan = plan_column(rows, 1)
+    return CohortColumns(
+        subscriber=np.cumsum(starts, dtype=np.int64) - 1,
+        month=column(rows, 2, np.int64),
+        cohort=column(rows, 3, np.int64),
+        plan=plan,
+        amount=column(rows, 4, np.float64),
+        yearly=plan_yearly[plan],
+        plan_ids=plan_ids,
+        signup_month=column(signups, 0, np.int64),
+        signup_plan=plan_column(signups, 1),
+        signup_count=column(signups, 2, np.int64),
+    )
+
+def load_columns(user_id):
+    plans = list(SubscriptionPlan.objects.filter(user_id=user_id).values_list('pk', 'interval'))
+    rows = list(
+        PaymentLedgerEntry.objects.filter(user_id=user_id)
+        .annotate(
+            subscriber_key=Cast('subscriber_id', CharField()),
+            plan_key=Cast('plan_id', CharField()),
+            month=month_index('created_at'),
+            cohort=month_index('subscriber__created_at'),
+        )
+        .values('subscriber_key', 'plan_key', 'month', 'cohort')
+        # Floats convert to an array an order of magnitude faster than Decimals
+        .annotate(revenue=Cast(Sum('amount'), FloatField()))
+        .order_by('subscriber_key', 'month')
+        .values_list('subscriber_key', 'plan_key', 'month', 'cohort', 'revenue')
+    )
+    signups = list(
+        Subscriber.objects.filter(plan__user_id=user_id)
+        .annotate(month=month_index('created_at'), plan_key=Cast('plan_id', CharField()))
+        .values('month', 'plan_key')
+        .annotate(total=Count('id'))
+        .values_list('month', 'plan_key', 'total')
+    )
+    return build_columns(plans, rows, signups)
+
+def monthly_revenue(columns, current):
+    # Spreads yearly payments over 12 months and sums per (subscriber, month) up to `current`.
+    # Returns (subscriber, month, mrr) for positive months, sorted by subscriber then month.
+    yearly = columns.yearly
+    subscriber = np.concatenate([columns.subscriber[~yearly], np.repeat(columns.subscriber[yearly], 12)])
+    month = np.concatenate([
+        columns.month[~yearly],
+        (columns.month[yearly][:, None] + np.arange(12)).ravel(),
+    ])
+    amount = np.concatenate([columns.amount[~yearly], np.repeat(columns.amount[yearly] / 12, 12)])
+    elapsed = month <= current
+    subscriber, month, amount = subscriber[elapsed], month[elapsed], amount[elapsed]
+    if not len(month):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, np.zeros(0)
+
+    base = month.min()
+    span = current - base + 1
+    keys = subscriber * span + (month - base)
+    # Both halves are already sorted (rows come ordered from SQL), so the stable sort is a merge
+    order = np.argsort(keys, kind='stable')
+    keys, amount = keys[order], amount[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    keys, mrr = keys[starts], np.add.reduceat(amount, starts)
+    positive = mrr > 1e-9
+    keys, mrr = keys[positive], mrr[positive]
+    return keys // span, keys % span + base, mrr
+
+def per_month(month, start, months, weights=None):
+    inside = (month >= start) & (month < start + months)
+    return np.bincount(
+        month[inside] - start,
+        weights=None if weights is None else weights[inside],
+        minlength=months,
+    )[:months]
+
+def mrr_movement(subscriber, month, mrr, start, months, current):
+    same = np.zeros(len(month), dtype=bool)
+    same[1:] = subscriber[1:] == subscriber[:-1]
+    consecutive = same.copy()
+    consecutive[1:] &= month[1:] - month[:-1] == 1
+    previous = np.zeros(len(month))
+    previous[1:] = mrr[:-1]
+    previous[~consecutive] = 0.0
+    continues = np.zeros(len(month), dtype=bool)  # the next row is the following month
+    continues[:-1] = consecutive[1:]
+
+    new = ~same
+    reactivated = same & ~consecutive
+    delta = mrr - previous
+    expansion = consecutive & (delta > 1e-9)
+    contraction = consecutive & (delta < -1e-9)
+    # Active this month, not the next one, and the next one is over: the current month is
+    # still in progress, so a renewal due later this month is not churn yet
+    churned = ~continues & (month + 1 < current)
+
+    return {
+        'new': per_month(month[new], start, months, mrr[new]),
+        'expansion': per_month(month[expansion], start, months, delta[expansion]),
+        'contraction': per_month(month[contraction], start, months, -delta[contraction]),
+        'reactivated': per_month(month[reactivated], start, months, mrr[reactivated]),
+        'churned': per_month(month[churned] + 1, start, months, mrr[churned]),
+        'churned_count': per_month(month[churned] + 1, start, months),
+        'active_count': per_month(month, start - 1, months + 1),  # includes the month before start
+    }
+
+def retention_matrices(columns, subscriber, month, start, months):
+    # active[plan, cohort, offset]: subscribers of a signup month still paying `offset` months later
+    plan_count = len(columns.plan_ids) + 1
+    cohort_by_subscriber = np.zeros(columns.subscriber.max() + 1 if len(columns.subscriber) else 0, dtype=np.int64)
+    plan_by_subscriber = np.zeros_like(cohort_by_subscriber)
+    cohort_by_subscriber[columns.subscriber] = columns.cohort
+    plan_by_subscriber[columns.subscriber] = columns.plan
+
+    cohort = cohort_by_subscriber[subscriber]
+    offset = month - cohort
+    inside = (cohort >= start) & (cohort < start + months) & (offset >= 0) & (offset < months)
+    cell = (plan_by_subscriber[subscriber[inside]] * months + cohort[inside] - start) * months + offset[inside]
+    active = np.bincount(cell, minlength=plan_count * months * months).reshape(plan_count, months, months)
+
+    signups_inside = (columns.signup_month >= start) & (columns.signup_month < start + months)
+    sizes = np.zeros((plan_count, months), dtype=np.int64)
+    np.add.at(
+        sizes,
+        (columns.signup_plan[signups_inside], columns.signup_month[signups_inside] - start),
+        columns.signup_count[signups_inside],
+    )
+    return active, sizes
+
+def rates(numerator, denominator):
+    return np.divide(
+        numerator, denominator,
+        out=np.zeros(np.broadcast(numerator, denominator).shape, dtype=np.float64),
+        where=denominator > 0,
+    )
+
+def cohort_engine(columns, months, current):
+    # Pure NumPy part: CohortColumns in, JSON-ready report out
+    start = current - months + 1
+    subscriber, month, mrr = monthly_revenue(columns, current)
+
+    movement = mrr_movement(subscriber, month, mrr, start, months, current)
+    active, sizes = retention_matrices(columns, subscriber, month, start, months)
+
+    active_before = movement['active_count'][:-1].copy()  # active in the previous month
+    active_before[-1] = 0  # the current month's churn is not known yet, see mrr_movement()
+    churn_rate = rates(movement['churned_count'], active_before)
+    window = np.ones(ROLLING_WINDOW)
+    rolling = rates(
+        np.convolve(movement['churned_count'], window)[:months],
+        np.convolve(active_before, window)[:months],
+    )
+
+    def matrix(active_cells, size_cells):
+        return {
+            'sizes': size_cells.tolist(),
+            'active': active_cells.tolist(),
+            'retention': np.round(rates(active_cells, size_cells[:, None]), 4).tolist(),
+        }
+
+    labels = [month_label(index) for index in range(start, current + 1)]
+    return {
+        'months': labels,
+        'cohorts': matrix(active.sum(axis=0), sizes.sum(axis=0)),
+        'cohorts_by_plan': {
+            plan_id: matrix(active[index], sizes[index])
+            for index, plan_id in enumerate(columns.plan_ids)
+        },
+        'mrr_movement': [
+            {
+                'month': label,
+                'new': round(float(movement['new'][i]), 6),
+                'expansion': round(float(movement['expansion'][i]), 6),
+                'contraction': round(float(movement['contraction'][i]), 6),
+                'reactivated': round(float(movement['reactivated'][i]), 6),
+                'churned': round(float(movement['churned'][i]), 6),
+            }
+            for i, label in enumerate(labels)
+        ],
+        'churn': [
+            {
+                'month': label,
+                'churned_subscribers': int(movement['churned_count'][i]),
+                'churn_rate': round(float(churn_rate[i]) * 100, 4),
+                'rolling_churn_rate': round(float(rolling[i]) * 100, 4),
+                # Churn is only counted for finished months
+                'partial': i == months - 1,
+            }
+            for i, label in enumerate(labels)
+        ],
+    }
+
+def compute_cohorts(user_id, months=24, today=None):
+    today = today or timezone.localdate()
+    return cohort_engine(load_columns(user_id), months, today.year * 12 + today.month - 1)
+"""
+
+"""
+# signals.py
+
+# Keep DailyMetricsSnapshot, the plan counters, the payment ledger and the response cache up
+# to date from individual writes. QuerySet.update() and bulk_create() bypass these receivers:
+# callers doing bulk writes must call rollups.apply_delta(), counters.plan_counter_batch(),
+# ledger.append_payment_changes() and cache.invalidate_on_commit() themselves; drift left
+# behind is repaired by rollups.reconcile_snapshots() and counters.reconcile_plan_counters().
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .archive import delete_segment_file
+from .authentication import api_key_cache, token_versions
+from .cache import invalidate_on_commit
+from .counters import count_subscriber_change
+from .instrumentation import install_query_recorder
+from .ledger import append_payment_change
+from .models import APIKey, ArchiveSegment, Payment, Subscriber, SubscriptionPlan, User
+from .rollups import record_payment_change, record_plan_price_change, record_subscriber_change
+
+def moved_from_plan(subscriber):
+    # The plan the subscriber was loaded with, when it has since moved to another one
+    plan_id = getattr(subscriber, '_loaded_plan_id', None)
+    if plan_id is None or plan_id == subscriber.plan_id:
+        return None
+    return SubscriptionPlan.objects.only('user_id', 'amount', 'interval').get(pk=plan_id)
+
+@receiver(post_save, sender=Subscriber)
+def subscriber_saved(sender, instance, created, **kwargs):
+    old_status = None if created else getattr(instance, '_loaded_status', instance.status)
+    old_plan = None if created else moved_from_plan(instance)
+    record_subscriber_change(instance, old_status, instance.status, old_plan)
+    count_subscriber_change(instance, old_status, instance.status, old_plan and old_plan.pk)
+    if old_plan is not None:
+        invalidate_on_commit([old_plan.user_id])
+    instance._loaded_status = instance.status
+    instance._loaded_plan_id = instance.plan_id
+
+@receiver(post_delete, sender=Subscriber)
+def subscriber_deleted(sender, instance, **kwargs):
+    old_status = getattr(instance, '_loaded_status', instance.status)
+    old_plan = moved_from_plan(instance)
+    record_subscriber_change(instance, old_status, None, old_plan)
+    count_subscriber_change(instance, old_status, None, old_plan and old_plan.pk)
+
+@receiver(post_save, sender=Payment)
+def payment_saved(sender, instance, created, **kwargs):
+    old_status = None if created else getattr(instance, '_loaded_status', instance.status)
+    # Ledger first: a rollup backfill triggered by this change reads revenue from the ledger
+    append_payment_change(instance, old_status, instance.status)
+    record_payment_change(instance, old_status, instance.status)
+    instance._loaded_status = instance.status
+
+@receiver(post_delete, sender=Payment)
+def payment_deleted(sender, instance, **kwargs):
+    old_status = getattr(instance, '_loaded_status', instance.status)
+    append_payment_change(instance, old_status, None)
+    record_payment_change(instance, old_status, None)
+
+@receiver(post_save, sender=SubscriptionPlan)
+def plan_saved(sender, instance, created, **kwargs):
+    old_amount, old_interval = getattr(instance, '_loaded_pricing', (None, None))
+    if not created and old_amount is not None and old_interval is not None:
+        record_plan_price_change(instance, old_amount, old_interval)
+    instance._loaded_pricing = (instance.amount, instance.interval)
+
+# Registered after the counter receivers, so the cache is invalidated after the counter flush
+@receiver(post_save, sender=SubscriptionPlan)
+@receiver(post_delete, sender=SubscriptionPlan)
+def plan_changed(sender, instance, **kwargs):
+    invalidate_on_commit([instance.user_id], 'plans')
+
+@receiver(post_save, sender=Subscriber)
+@receiver(post_delete, sender=Subscriber)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def plan_activity_changed(sender, instance, **kwargs):
+    # Plan counters and analytics both move with subscriber and payment writes
+    invalidate_on_commit([instance.plan.user_id])
+
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def api_key_changed(sender, instance, **kwargs):
+    # Revocation, expiry changes and deletions take effect immediately in this process
+    api_key_cache.delete(instance.hashed_key)
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    api_key_cache.delete_where(lambda api_key: api_key.user_id == instance.pk)
+    if getattr(instance, '_tokens_revoked', False):
+        user_id, version = instance.pk, instance.auth_version
+        transaction.on_commit(lambda: token_versions.revoke_before(user_id, version))
+
+@receiver(post_delete, sender=ArchiveSegment)
+def archive_segment_deleted(sender, instance, **kwargs):
+    # Deleting a merchant cascades to its segments; the files go once that commits
+    transaction.on_commit(lambda: delete_segment_file(instance.storage_name))
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    # Per-request query metrics, see instrumentation.record_query
+    install_query_recorder(connection)
+"""
+
+"""
+# apps.py
+
+from django.apps import AppConfig
+
+class SubchainConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'subchain'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+"""
@@ -4,9 +4,13 @@
 """
 # models.py
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Q
 from django.core.validators import MinValueValidator
+from django.utils import timezone
+import hashlib
 import uuid
 import secrets
 
@@ -23,12 +27,41 @@ class User(AbstractUser):
         ],
         default='starter'
     )
+    # Access tokens carrying an older auth_version are rejected, see authentication.py
+    auth_version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
 
+    # Fields copied into access token claims, next to the id and auth_version
+    TOKEN_CLAIM_FIELDS = ('plan_tier', 'is_active')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_claims = instance.loaded_claims()
+        return instance
+
+    def loaded_claims(self):
+        return {name: self.__dict__[name] for name in self.TOKEN_CLAIM_FIELDS if name in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        # A new password or a changed claim retires every access token issued before it.
+        # QuerySet.update() bypasses this: bump auth_version in the same update.
+        loaded = getattr(self, '_loaded_claims', None)
+        self._tokens_revoked = loaded is not None and (
+            self._password is not None
+            or any(self.__dict__.get(name, value) != value for name, value in loaded.items())
+        )
+        if self._tokens_revoked:
+            self.auth_version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'auth_version'}
+        super().save(*args, **kwargs)
+        self._loaded_claims = self.loaded_claims()
+
 class SubscriptionPlan(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='plans')
@@ -61,7 +94,18 @@ class SubscriptionPlan(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination on (created_at, id), see pagination.KeysetPagination
+            models.Index(fields=['user', '-created_at', '-id'], name='plan_user_created_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the loaded price so signals can move MRR when it is edited
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_pricing = (instance.__dict__.get('amount'), instance.__dict__.get('interval'))
+        return instance
 
 class Subscriber(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -88,9 +132,37 @@ class Subscriber(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination on (created_at, id), see pagination.KeysetPagination
+            models.Index(fields=['plan', '-created_at', '-id'], name='subscriber_plan_created_idx'),
+            # Status filters and breakdowns over a merchant's plans
+            models.Index(fields=['plan', 'status'], name='subscriber_plan_status_idx'),
+            # MRR / active counts only ever read the active subset
+            models.Index(fields=['plan'], condition=Q(status='active'), name='subscriber_active_idx'),
+            # 30-day churn: status='cancelled' AND updated_at >= ...
+            models.Index(
+                fields=['plan', 'updated_at'],
+                condition=Q(status='cancelled'),
+                name='subscriber_cancelled_idx',
+            ),
+            # Billing cycle: keyset walk over due active subscribers, see billing.py
+            models.Index(
+                fields=['next_payment_date', 'id'],
+                condition=Q(status='active'),
+                name='subscriber_due_idx',
+            ),
+        ]
         unique_together = ['plan', 'wallet_address']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the loaded status and plan so signals can detect transitions without a query
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_plan_id = instance.__dict__.get('plan_id')
+        return instance
+
 class Payment(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name='payments')
@@ -121,7 +193,34 @@ class Payment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Keyset pagination on (created_at, id), see pagination.KeysetPagination
+            models.Index(fields=['plan', '-created_at', '-id'], name='payment_plan_created_idx'),
+            # Revenue sums: index-only scan over completed payments
+            models.Index(
+                fields=['plan'],
+                include=['amount'],
+                condition=Q(status='completed'),
+                name='payment_completed_idx',
+            ),
+            # Chain reconciler: the (small) set of payments awaiting confirmation
+            models.Index(fields=['created_at'], condition=Q(status='pending'), name='payment_pending_idx'),
+        ]
+        constraints = [
+            # One on-chain transfer settles at most one payment, see chain.settle_chunk()
+            models.UniqueConstraint(
+                fields=['algorand_txn_id'],
+                condition=Q(status='completed'),
+                name='payment_completed_txn_unique',
+            ),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
 
 class Webhook(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -138,16 +237,40 @@ class Webhook(models.Model):
     class Meta:
         ordering = ['-created_at']
 
+API_KEY_PREFIX_LENGTH = 16
+
+def generate_api_key():
+    return f"sk_{'test' if settings.DEBUG else 'live'}_{secrets.token_urlsafe(32)}"
+
+def hash_api_key(raw_key):
+    # Keys are 256-bit random tokens, so a fast digest is enough (no password hashing)
+    return hashlib.sha256(raw_key.encode()).hexdigest()
+
+class APIKeyManager(models.Manager):
+    def create_key(self, **fields):
+        # Returns (api_key, raw_key); the raw key is never stored and can only be shown now
+        raw_key = generate_api_key()
+        api_key = self.create(
+            prefix=raw_key[:API_KEY_PREFIX_LENGTH],
+            hashed_key=hash_api_key(raw_key),
+            **fields,
+        )
+        return api_key, raw_key
+
 class APIKey(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_keys')
     name = models.CharField(max_length=100)
-    key = models.CharField(max_length=64, unique=True, default=lambda: f"sk_{'test' if settings.DEBUG else 'live'}_{secrets.token_urlsafe(32)}")
+    # Clear-text prefix to find the row (e.g. sk_live_AbCdEfGh), then the hash is compared
+    prefix = models.CharField(max_length=API_KEY_PREFIX_LENGTH, db_index=True, editable=False)
+    hashed_key = models.CharField(max_length=64, unique=True, editable=False)
     is_active = models.BooleanField(default=True)
     last_used = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(blank=True, null=True)
 
+    objects = APIKeyManager()
+
     class Meta:
         ordering = ['-created_at']
 
@@ -166,6 +289,8 @@ class WebhookEvent(models.Model):
         default='pending'
     )
     attempts = models.PositiveIntegerField(default=0)
+    # Earliest time the dispatcher may (re)try; pushed forward by backoff and by claim leases
+    next_attempt_at = models.DateTimeField(default=timezone.now)
     response_status = models.PositiveIntegerField(blank=True, null=True)
     response_body = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -173,4 +298,652 @@ class WebhookEvent(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Dispatcher queue: pending events due for an attempt
+            models.Index(
+                fields=['next_attempt_at'],
+                condition=Q(status='pending'),
+                name='webhookevent_due_idx',
+            ),
+        ]
+
+class DailyMetricsSnapshot(models.Model):
+    # State columns are carried forward day to day, flow columns only cover the day itself
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_metrics')
+    date = models.DateField()
+    mrr = models.DecimalField(max_digits=15, decimal_places=6, default=0)
+    total_subscribers = models.IntegerField(default=0)
+    active_subscribers = models.IntegerField(default=0)
+    cancelled_subscribers = models.IntegerField(default=0)
+    paused_subscribers = models.IntegerField(default=0)
+    past_due_subscribers = models.IntegerField(default=0)
+    cumulative_revenue = models.DecimalField(max_digits=15, decimal_places=6, default=0)
+    new_subscribers = models.IntegerField(default=0)
+    churned_subscribers = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=15, decimal_places=6, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ['user', 'date']
+
+class PaymentLedgerEntry(models.Model):
+    # Append-only: rows are never updated or deleted, corrections are new (negative) entries.
+    # References are plain columns without constraints so deleting or archiving a payment
+    # never touches the ledger.
+    seq = models.BigAutoField(primary_key=True)
+    kind = models.CharField(
+        max_length=10,
+        choices=[
+            ('payment', 'Payment'),
+            ('refund', 'Refund'),
+            ('reversal', 'Reversal'),
+        ]
+    )
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    plan = models.ForeignKey(SubscriptionPlan, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    payment = models.ForeignKey(Payment, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    amount = models.DecimalField(max_digits=15, decimal_places=6)  # signed
+    currency = models.CharField(max_length=10)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['seq']
+        indexes = [
+            # Checkpoint + tail reads: SUM(amount) WHERE <owner> = ? AND seq > checkpoint
+            models.Index(fields=['user', 'seq'], name='ledger_user_seq_idx'),
+            models.Index(fields=['plan', 'seq'], name='ledger_plan_seq_idx'),
+            models.Index(fields=['subscriber', 'seq'], name='ledger_subscriber_seq_idx'),
+        ]
+
+class LedgerCheckpoint(models.Model):
+    # SubscriptionPlan.total_revenue and Subscriber.total_paid include every entry up to seq
+    seq = models.BigIntegerField(unique=True)
+    entries = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-seq']
+
+class ChainWatermark(models.Model):
+    # Last block round fully processed by a chain reconciler, see chain.py
+    name = models.CharField(max_length=50, unique=True)
+    round = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class ArchiveSegment(models.Model):
+    # Gzipped NDJSON file in cold storage holding one merchant's archived rows of one kind
+    # created in one month (several segments when a month is large), see archive.py
+    kind = models.CharField(
+        max_length=20,
+        choices=[
+            ('payment', 'Payment'),
+            ('webhook_event', 'Webhook event'),
+        ]
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archive_segments')
+    period = models.DateField()  # first day of the month
+    row_count = models.PositiveIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    storage_name = models.CharField(max_length=255, unique=True)
+    compressed_size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-period', '-id']
+        indexes = [
+            models.Index(fields=['user', 'kind', '-period'], name='archive_user_kind_period_idx'),
+        ]
+
+class ArchivedRecord(models.Model):
+    # Primary key of an archived Payment or WebhookEvent -> the segment holding it
+    id = models.UUIDField(primary_key=True, editable=False)
+    segment = models.ForeignKey(ArchiveSegment, on_delete=models.CASCADE, related_name='records')
+"""
+
+"""
+# migrations/0002_query_indexes.py
+
+# Builds the indexes without locking writes on PostgreSQL (CREATE INDEX CONCURRENTLY),
+# and falls back to a plain CREATE INDEX on other backends such as SQLite in tests.
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models import Q
+
+class AddIndexConcurrentlyIfSupported(AddIndexConcurrently):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        return migrations.AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('subchain', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyIfSupported(
+            model_name='subscriptionplan',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='plan_user_created_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='subscriber',
+            index=models.Index(fields=['plan', '-created_at', '-id'], name='subscriber_plan_created_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='subscriber',
+            index=models.Index(fields=['plan', 'status'], name='subscriber_plan_status_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='subscriber',
+            index=models.Index(fields=['plan'], condition=Q(status='active'), name='subscriber_active_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='subscriber',
+            index=models.Index(
+                fields=['plan', 'updated_at'],
+                condition=Q(status='cancelled'),
+                name='subscriber_cancelled_idx',
+            ),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='payment',
+            index=models.Index(fields=['plan', '-created_at', '-id'], name='payment_plan_created_idx'),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='payment',
+            index=models.Index(
+                fields=['plan'],
+                include=['amount'],
+                condition=Q(status='completed'),
+                name='payment_completed_idx',
+            ),
+        ),
+    ]
+"""
+
+"""
+# migrations/0003_search_indexes.py
+
+# PostgreSQL only: GIN indexes cannot be created on SQLite, where search.InProcessSearchBackend
+# is used instead. The indexes are not declared in Meta.indexes for the same reason.
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import TrigramExtension
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models.functions import Upper
+
+def search_indexes():
+    trigram = lambda column, name: GinIndex(OpClass(Upper(column), name='gin_trgm_ops'), name=name)
+    return [
+        ('subscriber', trigram('wallet_address', 'subscriber_wallet_trgm_idx')),
+        ('subscriber', trigram('email', 'subscriber_email_trgm_idx')),
+        ('subscriptionplan', trigram('name', 'plan_name_trgm_idx')),
+        ('subscriptionplan', trigram('description', 'plan_description_trgm_idx')),
+        ('subscriptionplan', GinIndex(
+            SearchVector('name', weight='A', config='english')
+            + SearchVector('description', weight='B', config='english'),
+            name='plan_search_document_idx',
+        )),
+    ]
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, index in search_indexes():
+        schema_editor.add_index(apps.get_model('subchain', model_name), index, concurrently=True)
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for model_name, index in search_indexes():
+        schema_editor.remove_index(apps.get_model('subchain', model_name), index, concurrently=True)
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('subchain', '0002_query_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
+"""
+
+"""
+# migrations/0004_hash_api_keys.py
+
+import hashlib
+from django.db import migrations, models
+
+PREFIX_LENGTH = 16
+
+def hash_existing_keys(apps, schema_editor):
+    APIKey = apps.get_model('subchain', 'APIKey')
+    keys = list(APIKey.objects.only('id', 'key'))
+    for api_key in keys:
+        api_key.prefix = api_key.key[:PREFIX_LENGTH]
+        api_key.hashed_key = hashlib.sha256(api_key.key.encode()).hexdigest()
+    APIKey.objects.bulk_update(keys, ['prefix', 'hashed_key'], batch_size=1000)
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('subchain', '0003_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='prefix',
+            field=models.CharField(max_length=16, default='', editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='apikey',
+            name='hashed_key',
+            field=models.CharField(max_length=64, null=True, editable=False),
+        ),
+        migrations.RunPython(hash_existing_keys, migrations.RunPython.noop),
+        migrations.RemoveField(model_name='apikey', name='key'),
+        migrations.AlterField(
+            model_name='apikey',
+            name='prefix',
+            field=models.CharField(max_length=16, db_index=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='apikey',
+            name='hashed_key',
+            field=models.CharField(max_length=64, unique=True, editable=False),
+        ),
+    ]
+"""
+
+"""
+# migrations/0005_payment_ledger.py
+
+# Opens the ledger with one entry per completed payment and a checkpoint covering them.
+# total_revenue / total_paid were never maintained before the ledger, so they are rebuilt
+# from those entries first and become the first compacted state.
+
+from decimal import Decimal
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+def entry_total(PaymentLedgerEntry, owner):
+    # SUM(amount) of the entries for OuterRef('pk'), 0 without any
+    money = models.DecimalField(max_digits=15, decimal_places=6)
+    return Coalesce(Subquery(
+        PaymentLedgerEntry.objects.filter(**{owner: OuterRef('pk')})
+        .order_by()
+        .values(owner)
+        .annotate(total=Sum('amount'))
+        .values('total'),
+        output_field=money,
+    ), Value(Decimal('0'), output_field=money))
+
+def open_ledger(apps, schema_editor):
+    Payment = apps.get_model('subchain', 'Payment')
+    PaymentLedgerEntry = apps.get_model('subchain', 'PaymentLedgerEntry')
+    LedgerCheckpoint = apps.get_model('subchain', 'LedgerCheckpoint')
+    SubscriptionPlan = apps.get_model('subchain', 'SubscriptionPlan')
+    Subscriber = apps.get_model('subchain', 'Subscriber')
+
+    completed = Payment.objects.filter(status='completed').select_related('plan').order_by('created_at', 'id')
+    batch, count = [], 0
+    for payment in completed.iterator(chunk_size=2000):
+        batch.append(PaymentLedgerEntry(
+            kind='payment', user_id=payment.plan.user_id, plan_id=payment.plan_id,
+            subscriber_id=payment.subscriber_id, payment_id=payment.id,
+            amount=payment.amount, currency=payment.currency, created_at=payment.created_at,
+        ))
+        if len(batch) == 2000:
+            PaymentLedgerEntry.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+    PaymentLedgerEntry.objects.bulk_create(batch)
+    count += len(batch)
+
+    SubscriptionPlan.objects.update(total_revenue=entry_total(PaymentLedgerEntry, 'plan'))
+    Subscriber.objects.update(total_paid=entry_total(PaymentLedgerEntry, 'subscriber'))
+    last = PaymentLedgerEntry.objects.order_by('-seq').values_list('seq', flat=True).first()
+    LedgerCheckpoint.objects.create(seq=last or 0, entries=count)
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('subchain', '0004_hash_api_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentLedgerEntry',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('payment', 'Payment'), ('refund', 'Refund'), ('reversal', 'Reversal')], max_length=10)),
+                ('amount', models.DecimalField(decimal_places=6, max_digits=15)),
+                ('currency', models.CharField(max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='subchain.user')),
+                ('plan', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='subchain.subscriptionplan')),
+                ('subscriber', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='subchain.subscriber')),
+                ('payment', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='subchain.payment')),
+            ],
+            options={
+                'ordering': ['seq'],
+                'indexes': [
+                    models.Index(fields=['user', 'seq'], name='ledger_user_seq_idx'),
+                    models.Index(fields=['plan', 'seq'], name='ledger_plan_seq_idx'),
+                    models.Index(fields=['subscriber', 'seq'], name='ledger_subscriber_seq_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField(unique=True)),
+                ('entries', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={'ordering': ['-seq']},
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
+"""
+
+"""
+# migrations/0006_daily_metrics_snapshot.py
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('subchain', '0005_payment_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMetricsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('mrr', models.DecimalField(decimal_places=6, default=0, max_digits=15)),
+                ('total_subscribers', models.IntegerField(default=0)),
+                ('active_subscribers', models.IntegerField(default=0)),
+                ('cancelled_subscribers', models.IntegerField(default=0)),
+                ('paused_subscribers', models.IntegerField(default=0)),
+                ('past_due_subscribers', models.IntegerField(default=0)),
+                ('cumulative_revenue', models.DecimalField(decimal_places=6, default=0, max_digits=15)),
+                ('new_subscribers', models.IntegerField(default=0)),
+                ('churned_subscribers', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=6, default=0, max_digits=15)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_metrics', to='subchain.user')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('user', 'date')},
+            },
+        ),
+    ]
+"""
+
+"""
+# migrations/0007_webhook_event_schedule.py
+
+# The dispatcher's queue column and its partial index. Existing events become due at once;
+# the index is built without locking writes, see 0002.
+
+from importlib import import_module
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Q
+
+AddIndexConcurrentlyIfSupported = import_module('.0002_query_indexes', __package__).AddIndexConcurrentlyIfSupported
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('subchain', '0006_daily_metrics_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='webhookevent',
+            index=models.Index(
+                fields=['next_attempt_at'],
+                condition=Q(status='pending'),
+                name='webhookevent_due_idx',
+            ),
+        ),
+    ]
+"""
+
+"""
+# migrations/0008_subscriber_due_index.py
+
+from importlib import import_module
+from django.db import migrations, models
+from django.db.models import Q
+
+AddIndexConcurrentlyIfSupported = import_module('.0002_query_indexes', __package__).AddIndexConcurrentlyIfSupported
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('subchain', '0007_webhook_event_schedule'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyIfSupported(
+            model_name='subscriber',
+            index=models.Index(
+                fields=['next_payment_date', 'id'],
+                condition=Q(status='active'),
+                name='subscriber_due_idx',
+            ),
+        ),
+    ]
+"""
+
+"""
+# migrations/0009_chain_reconciler.py
+
+# Watermark table, pending-payment index and the one-payment-per-transfer constraint of the
+# chain reconciler. Payments completed before the constraint may already share a transfer: the
+# oldest keeps it, the others fail as chain.settle_chunk() would have failed them, with a
+# reversal ledger entry. On PostgreSQL the index and the constraint's unique index are built
+# without locking writes.
+
+from importlib import import_module
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.utils import timezone
+
+AddIndexConcurrentlyIfSupported = import_module('.0002_query_indexes', __package__).AddIndexConcurrentlyIfSupported
+
+COMPLETED_TXN_UNIQUE = models.UniqueConstraint(
+    fields=['algorand_txn_id'],
+    condition=Q(status='completed'),
+    name='payment_completed_txn_unique',
+)
+
+def fail_duplicate_settlements(apps, schema_editor):
+    Payment = apps.get_model('subchain', 'Payment')
+    PaymentLedgerEntry = apps.get_model('subchain', 'PaymentLedgerEntry')
+
+    completed = Payment.objects.filter(status='completed', algorand_txn_id__isnull=False)
+    shared = (
+        completed.order_by().values('algorand_txn_id')
+        .annotate(payments=Count('id')).filter(payments__gt=1)
+        .values_list('algorand_txn_id', flat=True)
+    )
+    now = timezone.now()
+    for txid in list(shared):
+        duplicates = list(completed.filter(algorand_txn_id=txid).select_related('plan').order_by('created_at', 'id')[1:])
+        for payment in duplicates:
+            payment.status = 'failed'
+            payment.failure_reason = f'Transfer {txid} already settled another payment'
+            payment.updated_at = now
+        Payment.objects.bulk_update(duplicates, ['status', 'failure_reason', 'updated_at'])
+        PaymentLedgerEntry.objects.bulk_create([
+            PaymentLedgerEntry(
+                kind='reversal', user_id=payment.plan.user_id, plan_id=payment.plan_id,
+                subscriber_id=payment.subscriber_id, payment_id=payment.id,
+                amount=-payment.amount, currency=payment.currency, created_at=now,
+            )
+            for payment in duplicates
+        ])
+
+def add_constraint(apps, schema_editor):
+    Payment = apps.get_model('subchain', 'Payment')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.add_constraint(Payment, COMPLETED_TXN_UNIQUE)
+        return
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        f"CREATE UNIQUE INDEX CONCURRENTLY {quote(COMPLETED_TXN_UNIQUE.name)} "
+        f"ON {quote(Payment._meta.db_table)} ({quote('algorand_txn_id')}) WHERE {quote('status')} = 'completed'"
+    )
+
+def remove_constraint(apps, schema_editor):
+    Payment = apps.get_model('subchain', 'Payment')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.remove_constraint(Payment, COMPLETED_TXN_UNIQUE)
+        return
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(COMPLETED_TXN_UNIQUE.name)}')
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('subchain', '0008_subscriber_due_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChainWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('round', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        AddIndexConcurrentlyIfSupported(
+            model_name='payment',
+            index=models.Index(fields=['created_at'], condition=Q(status='pending'), name='payment_pending_idx'),
+        ),
+        migrations.RunPython(fail_duplicate_settlements, migrations.RunPython.noop, atomic=True),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[migrations.AddConstraint(model_name='payment', constraint=COMPLETED_TXN_UNIQUE)],
+            database_operations=[migrations.RunPython(add_constraint, remove_constraint)],
+        ),
+    ]
+"""
+
+"""
+# migrations/0010_archive.py
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('subchain', '0009_chain_reconciler'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('payment', 'Payment'), ('webhook_event', 'Webhook event')], max_length=20)),
+                ('period', models.DateField()),
+                ('row_count', models.PositiveIntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('storage_name', models.CharField(max_length=255, unique=True)),
+                ('compressed_size', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='subchain.user')),
+            ],
+            options={
+                'ordering': ['-period', '-id'],
+                'indexes': [
+                    models.Index(fields=['user', 'kind', '-period'], name='archive_user_kind_period_idx'),
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedRecord',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='records', to='subchain.archivesegment')),
+            ],
+        ),
+    ]
+"""
+
+"""
+# migrations/0011_user_auth_version.py
+
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('subchain', '0010_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='auth_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
+"""
+
+"""
+# migrations/0012_keyset_ordering.py
+
+# State only: the (created_at, id) default ordering of the keyset-paginated models.
+
+from django.db import migrations
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('subchain', '0011_user_auth_version'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(name='subscriptionplan', options={'ordering': ['-created_at', '-id']}),
+        migrations.AlterModelOptions(name='subscriber', options={'ordering': ['-created_at', '-id']}),
+        migrations.AlterModelOptions(name='payment', options={'ordering': ['-created_at', '-id']}),
+    ]
 """
@@ -0,0 +1,1635 @@
+# Spécifications des services métier Django pour SubChain
+# À utiliser comme référence pour la logique hors vues (compteurs, tâches Celery...)
+
+"""
+# counters.py
+
+# SubscriptionPlan.subscriber_count. Revenue totals are derived from the payment ledger
+# instead, see ledger.py.
+
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from .cache import invalidate_on_commit
+from .models import SubscriptionPlan, Subscriber
+
+class PlanCounterBatch:
+    # Merges counter deltas per plan and applies them as one
+    # UPDATE ... SET col = col + delta per plan, never a read-modify-write
+    def __init__(self):
+        self.subscribers = defaultdict(int)
+
+    def add(self, plan_id, subscribers=0):
+        if subscribers:
+            self.subscribers[plan_id] += subscribers
+
+    def flush(self):
+        # Sorted so concurrent flushes lock plan rows in the same order
+        for plan_id in sorted(self.subscribers, key=str):
+            if self.subscribers[plan_id]:
+                SubscriptionPlan.objects.filter(pk=plan_id).update(
+                    subscriber_count=Greatest(F('subscriber_count') + self.subscribers[plan_id], Value(0))
+                )
+        self.subscribers.clear()
+
+@contextmanager
+def plan_counter_batch():
+    # For bulk writers: collect deltas for the whole block, apply them once after commit
+    batch = PlanCounterBatch()
+    yield batch
+    transaction.on_commit(batch.flush)
+
+def counts_toward_plan(status):
+    return status is not None and status != 'cancelled'
+
+def count_subscriber_change(subscriber, old_status, new_status, old_plan_id=None):
+    # old_status is None for a new subscriber, new_status is None for a deletion; old_plan_id
+    # is the plan the subscriber was loaded with when it has moved to another one
+    batch = PlanCounterBatch()
+    batch.add(old_plan_id or subscriber.plan_id, subscribers=-int(counts_toward_plan(old_status)))
+    batch.add(subscriber.plan_id, subscribers=int(counts_toward_plan(new_status)))
+    if any(batch.subscribers.values()):
+        # Applied after commit so the plan rows are only locked for a single short UPDATE
+        transaction.on_commit(batch.flush)
+
+def expected_subscriber_count():
+    return Coalesce(Subquery(
+        Subscriber.objects.filter(plan=OuterRef('pk'))
+        .exclude(status='cancelled')
+        .order_by()
+        .values('plan')
+        .annotate(total=Count('id'))
+        .values('total')
+    ), 0)
+
+def reconcile_plan_counters(chunk_size=500):
+    # Recompute counters from source rows and rewrite only the plans that drifted.
+    # The UPDATE evaluates the subquery itself, so a flush that runs before it is absorbed.
+    # It is not exact though: deltas are flushed after commit, so a subscriber change that
+    # committed before the UPDATE but flushes after it is counted by the subquery and then
+    # added again by the flush. Row locks can't close that window since the flush runs in
+    # its own transaction; the overshoot is one delta per such write and the next run
+    # corrects it, so run this periodically rather than relying on a single pass.
+    fixed = 0
+    last_id = None
+    while True:
+        plans = SubscriptionPlan.objects.order_by('pk')
+        if last_id is not None:
+            plans = plans.filter(pk__gt=last_id)
+        plan_ids = list(plans.values_list('pk', flat=True)[:chunk_size])
+        if not plan_ids:
+            return fixed
+        last_id = plan_ids[-1]
+
+        drifted = list(
+            SubscriptionPlan.objects.filter(pk__in=plan_ids)
+            .annotate(expected_count=expected_subscriber_count())
+            .exclude(subscriber_count=F('expected_count'))
+            .values_list('pk', flat=True)
+        )
+        if drifted:
+            fixed += SubscriptionPlan.objects.filter(pk__in=drifted).update(
+                subscriber_count=expected_subscriber_count(),
+            )
+            invalidate_on_commit(
+                SubscriptionPlan.objects.filter(pk__in=drifted).values_list('user_id', flat=True),
+                'plans',
+            )
+"""
+
+"""
+# ledger.py
+
+# Payment ledger. Revenue never updates a shared row on the write path: every change in a
+# payment's contribution appends a PaymentLedgerEntry (seq is monotonically increasing).
+# compact_ledger() periodically folds the entries into SubscriptionPlan.total_revenue and
+# Subscriber.total_paid and records a LedgerCheckpoint; exact balances are the stored value
+# plus the tail of entries after the latest checkpoint.
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import OperationalError, connection, transaction
+from django.db.models import DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .cache import invalidate_on_commit
+from .models import LedgerCheckpoint, PaymentLedgerEntry, SubscriptionPlan, Subscriber, User
+
+MONEY = DecimalField(max_digits=15, decimal_places=6)
+ZERO = Value(Decimal('0'), output_field=MONEY)
+# How long compaction waits for in-flight ledger writers before skipping the run (seconds)
+COMPACTION_LOCK_TIMEOUT = 0.5
+
+def ledger_entry(payment, old_status, new_status):
+    # Entry for a status transition, or None when the payment's contribution is unchanged
+    was_completed = old_status == 'completed'
+    is_completed = new_status == 'completed'
+    if was_completed == is_completed:
+        return None
+    if is_completed:
+        kind, amount = 'payment', payment.amount
+    else:
+        kind, amount = ('refund' if new_status == 'refunded' else 'reversal'), -payment.amount
+    return PaymentLedgerEntry(
+        kind=kind,
+        user_id=payment.plan.user_id,
+        plan_id=payment.plan_id,
+        subscriber_id=payment.subscriber_id,
+        payment_id=payment.pk,
+        amount=amount,
+        currency=payment.currency,
+    )
+
+def append_payment_change(payment, old_status, new_status):
+    entry = ledger_entry(payment, old_status, new_status)
+    if entry is not None:
+        entry.save()
+
+def append_payment_changes(changes):
+    # Bulk writers: changes are (payment, old_status, new_status) tuples
+    entries = [ledger_entry(*change) for change in changes]
+    return PaymentLedgerEntry.objects.bulk_create([entry for entry in entries if entry is not None])
+
+def checkpoint_seq():
+    return Coalesce(Subquery(LedgerCheckpoint.objects.order_by('-seq').values('seq')[:1]), 0)
+
+def ledger_tail(owner):
+    # SUM(amount) of the entries after the latest checkpoint for OuterRef('pk')
+    return Coalesce(Subquery(
+        PaymentLedgerEntry.objects.filter(**{owner: OuterRef('pk')}, seq__gt=checkpoint_seq())
+        .order_by()
+        .values(owner)
+        .annotate(total=Sum('amount'))
+        .values('total')
+    ), ZERO)
+
+def with_revenue_tail(plans):
+    return plans.annotate(revenue_tail=ledger_tail('plan'))
+
+def with_paid_tail(subscribers):
+    return subscribers.annotate(paid_tail=ledger_tail('subscriber'))
+
+def merchant_revenue(user_id):
+    # One query: compacted plan totals plus the merchant's ledger tail
+    plan_totals = Coalesce(Subquery(
+        SubscriptionPlan.objects.filter(user=OuterRef('pk'))
+        .order_by()
+        .values('user')
+        .annotate(total=Sum('total_revenue'))
+        .values('total')
+    ), ZERO)
+    return (
+        User.objects.filter(pk=user_id)
+        .annotate(revenue=plan_totals + ledger_tail('user'))
+        .values_list('revenue', flat=True)
+        .first()
+    ) or Decimal('0')
+
+def settled_seq(timeout=COMPACTION_LOCK_TIMEOUT):
+    # Highest seq that no in-flight transaction can still commit an entry below, or None if
+    # the writers did not finish within timeout. A seq cut-off by age is not enough: a
+    # transaction can draw seq N and commit after N + 1 has been compacted. Every INSERT holds
+    # ROW EXCLUSIVE on the table until its transaction ends and SHARE conflicts with it, so
+    # once the lock is granted every drawn seq is committed or rolled back. The lock is only
+    # held for the MAX(seq) read.
+    try:
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                table = connection.ops.quote_name(PaymentLedgerEntry._meta.db_table)
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT set_config('lock_timeout', %s, true)", [f'{int(timeout * 1000)}ms'])
+                    cursor.execute(f'LOCK TABLE {table} IN SHARE MODE')
+            # SQLite runs one writer at a time, so committed seqs never have in-flight gaps
+            return PaymentLedgerEntry.objects.aggregate(upto=Max('seq'))['upto']
+    except OperationalError:
+        return None
+
+def compact_ledger(timeout=COMPACTION_LOCK_TIMEOUT):
+    # Returns the new LedgerCheckpoint, or None when there is nothing to fold (or another
+    # compaction holds the latest checkpoint, or writers are still in flight)
+    LedgerCheckpoint.objects.get_or_create(seq=0)
+    upto = settled_seq(timeout)
+    with transaction.atomic():
+        latest = LedgerCheckpoint.objects.select_for_update(skip_locked=True).order_by('-seq').first()
+        if latest is None or LedgerCheckpoint.objects.filter(seq__gt=latest.seq).exists():
+            return None
+        if upto is None or upto <= latest.seq:
+            return None
+        window = PaymentLedgerEntry.objects.filter(seq__gt=latest.seq, seq__lte=upto).order_by()
+
+        plan_totals = defaultdict(Decimal)
+        subscriber_totals = defaultdict(Decimal)
+        user_ids, entries = set(), 0
+        for plan_id, subscriber_id, user_id, amount in window.values_list(
+            'plan_id', 'subscriber_id', 'user_id', 'amount'
+        ).iterator(chunk_size=5000):
+            plan_totals[plan_id] += amount
+            subscriber_totals[subscriber_id] += amount
+            user_ids.add(user_id)
+            entries += 1
+
+        # Sorted so plan rows are always locked in the same order
+        for plan_id in sorted(plan_totals, key=str):
+            SubscriptionPlan.objects.filter(pk=plan_id).update(total_revenue=F('total_revenue') + plan_totals[plan_id])
+        subscribers = list(
+            Subscriber.objects.select_for_update().filter(pk__in=list(subscriber_totals)).only('id', 'total_paid')
+        )
+        for subscriber in subscribers:
+            subscriber.total_paid += subscriber_totals[subscriber.pk]
+        Subscriber.objects.bulk_update(subscribers, ['total_paid'], batch_size=1000)
+
+        checkpoint = LedgerCheckpoint.objects.create(seq=upto, entries=entries)
+        invalidate_on_commit(user_ids, 'plans')
+        return checkpoint
+
+# (model, ledger column, stored total) pairs checked by verify_ledger
+LEDGER_TOTALS = [
+    (SubscriptionPlan, 'plan', 'total_revenue'),
+    (Subscriber, 'subscriber', 'total_paid'),
+]
+
+def verify_ledger(fix=False):
+    # Rebuilds every total from the whole ledger and diffs it against the stored fields as of
+    # the latest checkpoint. Returns [(model, pk, stored, expected)]; fix=True rewrites them.
+    with transaction.atomic():
+        latest = LedgerCheckpoint.objects.select_for_update().order_by('-seq').first()
+        entries = PaymentLedgerEntry.objects.filter(seq__lte=latest.seq if latest else 0).order_by()
+
+        diffs = []
+        for model, owner, field in LEDGER_TOTALS:
+            expected = dict(entries.values(owner).annotate(total=Sum('amount')).values_list(owner, 'total'))
+            for pk, stored in model.objects.values_list('pk', field).iterator(chunk_size=5000):
+                rebuilt = expected.get(pk, Decimal('0'))
+                if stored != rebuilt:
+                    diffs.append((model.__name__, pk, stored, rebuilt))
+                    if fix:
+                        model.objects.filter(pk=pk).update(**{field: rebuilt})
+        return diffs
+"""
+
+"""
+# search.py
+
+# Dashboard search. On PostgreSQL, substring filters are served by pg_trgm GIN indexes on
+# UPPER(column) (matching Django's icontains SQL) and plan ranking by a full-text GIN index,
+# see migrations/0003_search_indexes.py. SQLite test runs use the in-process backend.
+
+from functools import reduce
+from operator import or_
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Q
+
+SEARCH_CONFIG = 'english'
+
+def plan_document():
+    # Must stay identical to the expression indexed by plan_search_document_idx
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='B', config=SEARCH_CONFIG)
+    )
+
+def plan_filter(term):
+    return Q(name__icontains=term) | Q(description__icontains=term)
+
+def subscriber_filter(term):
+    return Q(wallet_address__icontains=term) | Q(email__icontains=term)
+
+class PostgresSearchBackend:
+    def filter_plans(self, queryset, term):
+        return queryset.filter(plan_filter(term))
+
+    def filter_subscribers(self, queryset, term):
+        return queryset.filter(subscriber_filter(term))
+
+    def rank_plans(self, queryset, term, limit=20):
+        query = SearchQuery(term, search_type='websearch', config=SEARCH_CONFIG)
+        return list(
+            queryset.annotate(document=plan_document())
+            .filter(document=query)
+            .annotate(rank=SearchRank(F('document'), query))
+            .order_by('-rank', '-created_at')[:limit]
+        )
+
+class InProcessSearchBackend:
+    # Same results without PostgreSQL extensions; ranking mirrors ts_rank's A/B weights
+    NAME_WEIGHT = 1.0
+    DESCRIPTION_WEIGHT = 0.4
+
+    def filter_plans(self, queryset, term):
+        return queryset.filter(plan_filter(term))
+
+    def filter_subscribers(self, queryset, term):
+        return queryset.filter(subscriber_filter(term))
+
+    def rank_plans(self, queryset, term, limit=20):
+        words = term.lower().split()
+        if not words:
+            return []
+
+        scored = []
+        for plan in queryset.filter(reduce(or_, (plan_filter(word) for word in words))):
+            name, description = plan.name.lower(), plan.description.lower()
+            rank = sum(
+                name.count(word) * self.NAME_WEIGHT + description.count(word) * self.DESCRIPTION_WEIGHT
+                for word in words
+            )
+            plan.rank = rank
+            scored.append(plan)
+
+        scored.sort(key=lambda plan: (-plan.rank, -plan.created_at.timestamp()))
+        return scored[:limit]
+
+def get_search_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return InProcessSearchBackend()
+"""
+
+"""
+# billing.py
+
+# Renewal engine. Due subscribers are claimed in (next_payment_date, id) keyset chunks with
+# SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can run a cycle concurrently:
+# each one locks a disjoint set of rows and skips the ones already held by another worker.
+# Every chunk is one transaction: a bulk INSERT of payments and ledger entries, a bulk UPDATE
+# of subscribers and one rollup delta per merchant. bulk_create()/bulk_update() bypass
+# signals.py, so the deltas are applied here. Only a completed charge moves next_payment_date
+# on; a pending one leaves it until chain.py settles the payment, and a subscriber with an
+# open invoice is not billed again meanwhile.
+
+import calendar
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Optional
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .cache import invalidate_on_commit
+from .ledger import append_payment_changes
+from .models import Payment, Subscriber
+from .rollups import apply_delta, plan_monthly_amount, status_deltas
+
+CHUNK_SIZE = 1000
+
+@dataclass
+class Charge:
+    # completed (funds received), pending (settled later on-chain) or failed
+    status: str
+    transaction_id: Optional[str] = None
+    failure_reason: str = ''
+
+class PendingCollector:
+    # Default collector: issues the invoice and leaves settlement to the chain reconciler, which
+    # fails it if no transaction is recorded within chain.INVOICE_TIMEOUT
+    def collect(self, payments):
+        return {payment.id: Charge('pending') for payment in payments}
+
+def get_collector():
+    path = getattr(settings, 'SUBCHAIN_BILLING_COLLECTOR', 'subchain.billing.PendingCollector')
+    return import_string(path)()
+
+def add_months(moment, months):
+    month = moment.month - 1 + months
+    year, month = moment.year + month // 12, month % 12 + 1
+    day = min(moment.day, calendar.monthrange(year, month)[1])
+    return moment.replace(year=year, month=month, day=day)
+
+def next_billing_date(moment, interval):
+    return add_months(moment, 12 if interval == 'yearly' else 1)
+
+def claim_due_subscribers(now, after, chunk_size):
+    # Served by subscriber_due_idx; must run inside a transaction
+    queryset = (
+        Subscriber.objects.select_for_update(skip_locked=True, of=('self',))
+        .select_related('plan')
+        .filter(status='active', next_payment_date__lte=now)
+        .filter(~Exists(Payment.objects.filter(subscriber=OuterRef('pk'), status='pending')))
+        .order_by('next_payment_date', 'id')
+    )
+    if after is not None:
+        due, pk = after
+        queryset = queryset.filter(
+            Q(next_payment_date__gt=due) | Q(next_payment_date=due, id__gt=pk)
+        )
+    return list(queryset[:chunk_size])
+
+def bill_chunk(subscribers, collector, now):
+    payments = [
+        Payment(
+            subscriber=subscriber,
+            plan=subscriber.plan,
+            amount=subscriber.plan.amount,
+            currency=subscriber.plan.currency,
+            due_date=subscriber.next_payment_date,
+        )
+        for subscriber in subscribers
+    ]
+    charges = collector.collect(payments)
+
+    totals = Counter()
+    rollup_deltas = defaultdict(Counter)
+    for subscriber, payment in zip(subscribers, payments):
+        charge = charges[payment.id]
+        plan = subscriber.plan
+        payment.status = charge.status
+        payment.algorand_txn_id = charge.transaction_id
+        payment.failure_reason = charge.failure_reason
+        subscriber.updated_at = now
+        totals[charge.status] += 1
+
+        if charge.status == 'failed':
+            subscriber.status = 'past_due'
+            monthly = plan_monthly_amount(plan)
+            rollup_deltas[plan.user_id].update(status_deltas('active', monthly, -1))
+            rollup_deltas[plan.user_id].update(status_deltas('past_due', monthly, 1))
+            continue
+
+        if charge.status == 'completed':
+            subscriber.next_payment_date = next_billing_date(subscriber.next_payment_date, plan.interval)
+            subscriber.last_payment_date = now
+            rollup_deltas[plan.user_id].update(revenue=payment.amount, cumulative_revenue=payment.amount)
+
+    Payment.objects.bulk_create(payments)
+    # total_paid and total_revenue follow from the ledger, see ledger.compact_ledger()
+    append_payment_changes((payment, None, payment.status) for payment in payments)
+    Subscriber.objects.bulk_update(
+        subscribers,
+        ['status', 'next_payment_date', 'last_payment_date', 'updated_at'],
+    )
+    for user_id, deltas in rollup_deltas.items():
+        apply_delta(user_id, **deltas)
+    invalidate_on_commit(subscriber.plan.user_id for subscriber in subscribers)
+    return totals
+
+def run_billing_cycle(collector=None, now=None, chunk_size=CHUNK_SIZE):
+    # Returns {'billed': n, 'completed': n, 'pending': n, 'failed': n} for this worker
+    collector = collector or get_collector()
+    now = now or timezone.now()
+    totals = Counter()
+    after = None
+    while True:
+        with transaction.atomic():
+            subscribers = claim_due_subscribers(now, after, chunk_size)
+            if not subscribers:
+                break
+            last = subscribers[-1]
+            # Cursor on the claimed values: a failed or pending row keeps its date, a completed
+            # one moves past it
+            after = (last.next_payment_date, last.id)
+            totals.update(bill_chunk(subscribers, collector, now))
+            totals['billed'] += len(subscribers)
+    return {key: totals[key] for key in ('billed', 'completed', 'pending', 'failed')}
+"""
+
+"""
+# chain.py
+
+# Confirms pending on-chain payments. Instead of one indexer call per transaction, each pass
+# scans the rounds produced since the last pass (ChainWatermark) once per receiving merchant
+# wallet. The indexer is queried before anything is locked; the matched payments are then
+# locked and settled in chunks of CHUNK_SIZE, one transaction and one set of bulk writes each.
+# Rows are re-read under the lock, so overlapping passes settle every payment once.
+
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+from typing import Optional
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .billing import next_billing_date
+from .cache import invalidate_on_commit
+from .ledger import append_payment_changes
+from .models import ChainWatermark, Payment, Subscriber
+from .rollups import apply_delta, plan_monthly_amount, status_deltas
+from .webhooks import emit_events
+
+WATERMARK = 'algorand'
+# Both ALGO (microAlgos) and USDC use 6 decimals on chain, like Payment.amount
+BASE_UNITS = Decimal('1000000')
+# Payments still unmatched after this long get a direct lookup, then fail
+CONFIRMATION_TIMEOUT = timedelta(hours=1)
+# Invoices (pending payments without a transaction id) fail after this long
+INVOICE_TIMEOUT = timedelta(days=3)
+CHUNK_SIZE = 500
+
+@dataclass
+class ChainTransaction:
+    txid: str
+    round: int
+    sender: str
+    receiver: str
+    amount: int  # base units
+    asset_id: Optional[int] = None  # None for ALGO
+
+class AlgorandIndexerClient:
+    # Indexer client interface: current_round(), transactions_to() and transaction()
+    PAGE_SIZE = 1000
+
+    def __init__(self, url=None, token=None):
+        from algosdk.v2client import indexer
+
+        self.client = indexer.IndexerClient(
+            token if token is not None else settings.ALGORAND_INDEXER_TOKEN,
+            url or settings.ALGORAND_INDEXER_URL,
+        )
+
+    def current_round(self):
+        return self.client.health()['round']
+
+    def transactions_to(self, address, min_round, max_round):
+        # Every confirmed transfer received by address in [min_round, max_round], paged
+        next_page = None
+        while True:
+            page = self.client.search_transactions_by_address(
+                address, min_round=min_round, max_round=max_round,
+                limit=self.PAGE_SIZE, next_page=next_page,
+            )
+            for txn in page.get('transactions', []):
+                parsed = self.parse(txn)
+                if parsed is not None and parsed.receiver == address:
+                    yield parsed
+            next_page = page.get('next-token')
+            if not next_page:
+                return
+
+    def transaction(self, txid):
+        from algosdk.error import IndexerHTTPError
+
+        try:
+            return self.parse(self.client.transaction(txid)['transaction'])
+        except IndexerHTTPError:
+            return None
+
+    @staticmethod
+    def parse(txn):
+        if 'payment-transaction' in txn:
+            transfer, asset_id = txn['payment-transaction'], None
+        elif 'asset-transfer-transaction' in txn:
+            transfer = txn['asset-transfer-transaction']
+            asset_id = transfer['asset-id']
+        else:
+            return None
+        return ChainTransaction(
+            txid=txn['id'],
+            round=txn['confirmed-round'],
+            sender=txn['sender'],
+            receiver=transfer['receiver'],
+            amount=transfer['amount'],
+            asset_id=asset_id,
+        )
+
+class FakeIndexer:
+    # In-memory chain for tests and local development: every add() confirms in a new round
+    def __init__(self, start_round=1000):
+        self.round = start_round
+        self.confirmed = []
+        self.calls = Counter()
+
+    def add(self, txid, sender, receiver, amount, asset_id=None):
+        self.round += 1
+        txn = ChainTransaction(txid, self.round, sender, receiver, amount, asset_id)
+        self.confirmed.append(txn)
+        return txn
+
+    def current_round(self):
+        self.calls['current_round'] += 1
+        return self.round
+
+    def transactions_to(self, address, min_round, max_round):
+        self.calls['transactions_to'] += 1
+        return [
+            txn for txn in self.confirmed
+            if txn.receiver == address and min_round <= txn.round <= max_round
+        ]
+
+    def transaction(self, txid):
+        self.calls['transaction'] += 1
+        return next((txn for txn in self.confirmed if txn.txid == txid), None)
+
+def get_indexer_client():
+    path = getattr(settings, 'SUBCHAIN_INDEXER_CLIENT', 'subchain.chain.AlgorandIndexerClient')
+    return import_string(path)()
+
+def to_base_units(amount):
+    return int(amount * BASE_UNITS)
+
+def expected_asset(payment):
+    return settings.ALGORAND_USDC_ASSET_ID if payment.currency == 'USDC' else None
+
+def settle(payment, txn):
+    # Returns (status, failure_reason) for a pending payment matched with a confirmed transfer
+    if txn.receiver != payment.plan.user.wallet_address:
+        return 'failed', f'Transfer {txn.txid} was not sent to the merchant wallet'
+    if txn.sender != payment.subscriber.wallet_address:
+        return 'failed', f'Transfer {txn.txid} was not sent from the subscriber wallet'
+    if txn.asset_id != expected_asset(payment):
+        return 'failed', f'Transfer {txn.txid} is not in {payment.currency}'
+    if txn.amount < to_base_units(payment.amount):
+        return 'failed', f'Transfer {txn.txid} is below the amount due'
+    return 'completed', ''
+
+def payment_payload(payment):
+    return {
+        'id': str(payment.id),
+        'subscriber': str(payment.subscriber_id),
+        'plan': str(payment.plan_id),
+        'amount': str(payment.amount),
+        'currency': payment.currency,
+        'status': payment.status,
+        'algorand_txn_id': payment.algorand_txn_id,
+        'confirmed_round': payment.metadata.get('confirmed_round'),
+        'failure_reason': payment.failure_reason,
+    }
+
+def apply_transitions(payments, now):
+    # payments already carry their new status; one write per table for the whole pass
+    subscribers = Subscriber.objects.select_for_update().in_bulk(
+        {payment.subscriber_id for payment in payments}
+    )
+    rollup_deltas = defaultdict(Counter)
+    for payment in payments:
+        payment.updated_at = now
+        plan = payment.plan
+        subscriber = subscribers[payment.subscriber_id]
+        deltas = rollup_deltas[plan.user_id]
+        monthly = plan_monthly_amount(plan)
+
+        if payment.status == 'completed':
+            subscriber.last_payment_date = now
+            # A settled renewal invoice moves the billing date on, see billing.bill_chunk()
+            due = subscriber.next_payment_date
+            if payment.due_date is not None and due is not None and due <= payment.due_date:
+                subscriber.next_payment_date = next_billing_date(payment.due_date, plan.interval)
+            deltas.update(revenue=payment.amount, cumulative_revenue=payment.amount)
+            if subscriber.status == 'past_due':
+                subscriber.status = 'active'
+                deltas.update(status_deltas('past_due', monthly, -1))
+                deltas.update(status_deltas('active', monthly, 1))
+        elif subscriber.status == 'active':
+            subscriber.status = 'past_due'
+            deltas.update(status_deltas('active', monthly, -1))
+            deltas.update(status_deltas('past_due', monthly, 1))
+        subscriber.updated_at = now
+
+    Payment.objects.bulk_update(payments, ['status', 'failure_reason', 'metadata', 'updated_at'])
+    append_payment_changes((payment, 'pending', payment.status) for payment in payments)
+    Subscriber.objects.bulk_update(
+        subscribers.values(), ['status', 'next_payment_date', 'last_payment_date', 'updated_at']
+    )
+    for user_id, deltas in rollup_deltas.items():
+        apply_delta(user_id, **deltas)
+    invalidate_on_commit(rollup_deltas)
+    emit_events(
+        (payment.plan.user_id, f'payment.{payment.status}', payment_payload(payment))
+        for payment in payments
+    )
+
+def settle_chunk(txids, found, now):
+    # Settles the pending payments carrying txids against the transfers found for them (a txid
+    # missing from found was looked up directly and never confirmed). Payments sharing a txid
+    # are always in the same chunk: the oldest one can claim it, the others fail.
+    with transaction.atomic():
+        payments = list(
+            Payment.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('plan__user', 'subscriber')
+            .filter(status='pending', algorand_txn_id__in=txids)
+            .order_by('created_at', 'id')
+        )
+        used = set(
+            Payment.objects.filter(status__in=('completed', 'refunded'), algorand_txn_id__in=txids)
+            .values_list('algorand_txn_id', flat=True)
+        )
+        changed = []
+        for payment in payments:
+            txn = found.get(payment.algorand_txn_id)
+            if txn is None:
+                if payment.created_at > now - CONFIRMATION_TIMEOUT:
+                    continue
+                payment.status, payment.failure_reason = 'failed', 'Transaction not confirmed in time'
+            elif payment.algorand_txn_id in used:
+                payment.status = 'failed'
+                payment.failure_reason = f'Transfer {txn.txid} already settled another payment'
+            else:
+                payment.status, payment.failure_reason = settle(payment, txn)
+                payment.metadata = {**payment.metadata, 'confirmed_round': txn.round}
+                if payment.status == 'completed':
+                    used.add(payment.algorand_txn_id)
+            changed.append(payment)
+        if changed:
+            apply_transitions(changed, now)
+    return changed
+
+def expire_invoices(now):
+    # Invoices nobody paid: without a transaction id there is nothing to look up
+    changed = []
+    while True:
+        with transaction.atomic():
+            payments = list(
+                Payment.objects.select_for_update(skip_locked=True, of=('self',))
+                .select_related('plan')
+                .filter(status='pending', algorand_txn_id__isnull=True, created_at__lte=now - INVOICE_TIMEOUT)
+                .order_by('created_at', 'id')[:CHUNK_SIZE]
+            )
+            if not payments:
+                return changed
+            for payment in payments:
+                payment.status, payment.failure_reason = 'failed', 'No transaction recorded before the invoice expired'
+            apply_transitions(payments, now)
+        changed.extend(payments)
+
+def reconcile_payments(client=None, now=None, watermark_name=WATERMARK):
+    # Returns {'from_round', 'to_round', 'completed', 'failed'}
+    client = client or get_indexer_client()
+    now = now or timezone.now()
+    watermark, _ = ChainWatermark.objects.get_or_create(name=watermark_name)
+    tip = client.current_round()
+    start = watermark.round + 1
+
+    # Read without locks: every row is re-checked when its chunk is settled
+    awaiting, receivers, stragglers = set(), set(), set()
+    for txid, created_at, wallet in (
+        Payment.objects.filter(status='pending', algorand_txn_id__isnull=False)
+        .values_list('algorand_txn_id', 'created_at', 'plan__user__wallet_address')
+        .iterator()
+    ):
+        awaiting.add(txid)
+        if wallet:
+            receivers.add(wallet)
+        if created_at <= now - CONFIRMATION_TIMEOUT:
+            stragglers.add(txid)
+
+    found = {}
+    if tip >= start:
+        for address in receivers:
+            for txn in client.transactions_to(address, start, tip):
+                if txn.txid in awaiting:
+                    found[txn.txid] = txn
+
+    # Stragglers: recorded after their round was scanned, or never confirmed
+    unconfirmed = set()
+    for txid in stragglers - found.keys():
+        txn = client.transaction(txid)
+        if txn is None:
+            unconfirmed.add(txid)
+        else:
+            found[txid] = txn
+
+    changed = []
+    txids = sorted(found.keys() | unconfirmed)
+    for offset in range(0, len(txids), CHUNK_SIZE):
+        changed.extend(settle_chunk(txids[offset:offset + CHUNK_SIZE], found, now))
+    changed.extend(expire_invoices(now))
+
+    # Only moves forward, also when passes overlap
+    ChainWatermark.objects.filter(name=watermark_name, round__lt=tip).update(round=tip, updated_at=now)
+
+    statuses = Counter(payment.status for payment in changed)
+    return {'from_round': start, 'to_round': tip, 'completed': statuses['completed'], 'failed': statuses['failed']}
+"""
+
+"""
+# subscriber_io.py
+
+# Bulk subscriber import/export. Uploads are read line by line and validated, deduplicated and
+# inserted in chunks: one SELECT for existing wallets, one INSERT and one counter/rollup delta
+# per chunk. bulk_create() bypasses signals.py, so those deltas are applied here.
+
+import csv
+import io
+import json
+from collections import Counter
+from dataclasses import dataclass
+from itertools import islice
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from .cache import invalidate_on_commit
+from .counters import plan_counter_batch
+from .models import Subscriber
+from .rollups import apply_delta, plan_monthly_amount, status_deltas
+from .serializers import SubscriberImportSerializer
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+
+EXPORT_FIELDS = [
+    'id', 'plan_id', 'wallet_address', 'email', 'status', 'start_date', 'next_payment_date',
+    'last_payment_date', 'total_paid', 'payment_method', 'created_at',
+]
+NEWLINE = chr(10)
+
+@dataclass
+class RowError:
+    # Yielded by read_rows() instead of a row that could not be parsed
+    errors: dict
+
+def read_rows(upload, file_format):
+    # Yields (line_number, row or RowError) without reading the whole upload into memory
+    text = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            # Empty cells fall back to the model defaults; metadata is a JSON cell
+            row = {key: value for key, value in row.items() if key and value not in ('', None)}
+            if 'metadata' in row:
+                try:
+                    row['metadata'] = json.loads(row['metadata'])
+                except json.JSONDecodeError:
+                    # The serializer's JSONField would store the raw cell as a JSON string
+                    yield reader.line_num, RowError({'metadata': ['Invalid JSON']})
+                    continue
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, RowError({'non_field_errors': ['Invalid JSON']})
+
+def import_chunk(plan, chunk, report):
+    valid = {}
+    for line_number, row in chunk:
+        if isinstance(row, RowError):
+            errors = row.errors
+        else:
+            serializer = SubscriberImportSerializer(data=row if isinstance(row, dict) else {})
+            errors = None if serializer.is_valid() else serializer.errors
+        if errors is not None:
+            report['invalid'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': line_number, 'errors': errors})
+            continue
+        wallet = serializer.validated_data['wallet_address']
+        if wallet in valid:
+            report['duplicates'] += 1
+        else:
+            valid[wallet] = serializer.validated_data
+
+    existing = set(
+        Subscriber.objects.filter(plan=plan, wallet_address__in=list(valid))
+        .values_list('wallet_address', flat=True)
+    )
+    report['duplicates'] += len(existing)
+    new = [Subscriber(plan=plan, **data) for wallet, data in valid.items() if wallet not in existing]
+    if not new:
+        return
+
+    with transaction.atomic(), plan_counter_batch() as counters:
+        # ignore_conflicts covers rows inserted concurrently since the SELECT above
+        Subscriber.objects.bulk_create(new, ignore_conflicts=True)
+        inserted = Counter(
+            Subscriber.objects.filter(pk__in=[subscriber.pk for subscriber in new])
+            .values_list('status', flat=True)
+        )
+        created = sum(inserted.values())
+        report['created'] += created
+        report['duplicates'] += len(new) - created
+
+        counters.add(plan.pk, subscribers=created - inserted['cancelled'])
+        deltas = Counter(total_subscribers=created, new_subscribers=created)
+        monthly = plan_monthly_amount(plan)
+        for status, count in inserted.items():
+            deltas.update(status_deltas(status, monthly, count))
+        apply_delta(plan.user_id, **deltas)
+        invalidate_on_commit([plan.user_id])
+
+def import_subscribers(plan, rows, chunk_size=CHUNK_SIZE):
+    # Returns {'created', 'duplicates', 'invalid', 'errors'}; errors are capped
+    report = {'created': 0, 'duplicates': 0, 'invalid': 0, 'errors': []}
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return report
+        import_chunk(plan, chunk, report)
+
+class Echo:
+    # File-like object whose write() hands the line back to the generator
+    def write(self, value):
+        return value
+
+def export_rows(queryset, file_format, chunk_size=2000):
+    # .iterator() streams rows from a server-side cursor on PostgreSQL
+    rows = queryset.order_by().values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+        for row in rows:
+            yield encoder.encode(dict(zip(EXPORT_FIELDS, row))) + NEWLINE
+"""
+
+"""
+# archive.py
+
+# Cold storage for Payment and WebhookEvent. Both tables only grow and are read newest first,
+# so settled rows older than a retention window are moved out: one merchant's rows of one kind
+# and month are written as gzipped NDJSON segments to the archive storage, indexed by
+# ArchiveSegment/ArchivedRecord, and deleted from the hot table. Listings keep scanning small
+# tables and indexes; archived rows stay readable through load_segment() and find_archived().
+#
+# Rows are deleted with plain SQL so signals.py never sees them: archiving moves a payment, it
+# does not reverse it, and revenue totals already live in the payment ledger.
+
+import gzip
+import json
+import tempfile
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from .models import ArchivedRecord, ArchiveSegment, Payment, WebhookEvent
+
+SEGMENT_ROWS = 50_000
+DELETE_BATCH = 500  # stays under SQLite's 999 bound parameters
+NEWLINE = chr(10)
+
+@dataclass(frozen=True)
+class ArchivePolicy:
+    kind: str
+    model: type
+    owner: str  # lookup from a row to its merchant
+    settled: Q  # rows that will not change anymore
+    retention_days: int
+
+POLICIES = [
+    ArchivePolicy('payment', Payment, 'plan__user', ~Q(status='pending'), 365),
+    ArchivePolicy('webhook_event', WebhookEvent, 'webhook__user', Q(status__in=['delivered', 'failed']), 90),
+]
+
+def get_storage():
+    return storages[getattr(settings, 'SUBCHAIN_ARCHIVE_STORAGE', 'default')]
+
+def retention(policy):
+    overrides = getattr(settings, 'SUBCHAIN_ARCHIVE_RETENTION_DAYS', {})
+    return timedelta(days=overrides.get(policy.kind, policy.retention_days))
+
+def eligible(policy, cutoff):
+    return policy.model.objects.filter(policy.settled, created_at__lt=cutoff).order_by()
+
+def next_month(month_start):
+    return (month_start + timedelta(days=32)).replace(day=1)
+
+def delete_rows(model, pks):
+    meta = model._meta
+    table, column = connection.ops.quote_name(meta.db_table), connection.ops.quote_name(meta.pk.column)
+    with connection.cursor() as cursor:
+        for start in range(0, len(pks), DELETE_BATCH):
+            batch = [meta.pk.get_db_prep_value(pk, connection) for pk in pks[start:start + DELETE_BATCH]]
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN ({placeholders})', batch)
+
+def write_segment(rows, name):
+    # Compresses rows into a spooled temp file and saves it; returns (stored name, size)
+    encoder = DjangoJSONEncoder()
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as buffer:
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as compressed:
+            for row in rows:
+                compressed.write((encoder.encode(row) + NEWLINE).encode())
+        size = buffer.tell()
+        buffer.seek(0)
+        return get_storage().save(name, File(buffer)), size
+
+def archive_segment(policy, user_id, month_start, cutoff):
+    # Moves up to SEGMENT_ROWS of one merchant's eligible rows created in one month.
+    # Returns the ArchiveSegment, or None when nothing is left to move.
+    model = policy.model
+    fields = [field.attname for field in model._meta.concrete_fields]
+    with transaction.atomic():
+        rows = list(
+            eligible(policy, cutoff)
+            .filter(**{policy.owner: user_id}, created_at__gte=month_start, created_at__lt=next_month(month_start))
+            .select_for_update(skip_locked=True, of=('self',))
+            .order_by('created_at', 'id')
+            .values(*fields)[:SEGMENT_ROWS]
+        )
+        if not rows:
+            return None
+
+        name, size = write_segment(rows, f'{policy.kind}/{user_id}/{month_start:%Y-%m}/{uuid.uuid4().hex}.ndjson.gz')
+        try:
+            segment = ArchiveSegment.objects.create(
+                kind=policy.kind,
+                user_id=user_id,
+                period=month_start.date(),
+                row_count=len(rows),
+                first_created_at=rows[0]['created_at'],
+                last_created_at=rows[-1]['created_at'],
+                storage_name=name,
+                compressed_size=size,
+            )
+            pks = [row['id'] for row in rows]
+            ArchivedRecord.objects.bulk_create(
+                [ArchivedRecord(id=pk, segment=segment) for pk in pks], batch_size=1000
+            )
+            delete_rows(model, pks)
+        except Exception:
+            get_storage().delete(name)
+            raise
+        return segment
+
+def archive_old_rows(now=None, max_segments=500):
+    # One archival pass over every policy; returns {kind: rows archived}. max_segments bounds
+    # the work per pass, the next pass picks up where this one stopped.
+    now = now or timezone.now()
+    archived = {}
+    for policy in POLICIES:
+        cutoff = now - retention(policy)
+        groups = (
+            eligible(policy, cutoff)
+            .values(owner_id=F(policy.owner), month_start=TruncMonth('created_at'))
+            .distinct()
+            .order_by('month_start', 'owner_id')
+        )
+        moved = 0
+        for group in groups:
+            while max_segments > 0:
+                segment = archive_segment(policy, group['owner_id'], group['month_start'], cutoff)
+                if segment is None:
+                    break
+                max_segments -= 1
+                moved += segment.row_count
+                if segment.row_count < SEGMENT_ROWS:
+                    break
+        archived[policy.kind] = moved
+    return archived
+
+def stream_segment(segment):
+    # NDJSON lines (bytes) of a segment, decompressed as they are read
+    with get_storage().open(segment.storage_name, 'rb') as stored:
+        with gzip.GzipFile(fileobj=stored) as lines:
+            yield from lines
+
+def load_segment(segment):
+    # Archived rows as dicts with JSON types (ids, amounts and dates are strings)
+    for line in stream_segment(segment):
+        yield json.loads(line)
+
+def find_archived(pk, user):
+    # The archived row with this primary key, if it belongs to the merchant
+    record = ArchivedRecord.objects.select_related('segment').filter(pk=pk, segment__user=user).first()
+    if record is None:
+        return None
+    key = str(record.pk)
+    return next((row for row in load_segment(record.segment) if row['id'] == key), None)
+
+def delete_segment_file(storage_name):
+    get_storage().delete(storage_name)
+"""
+
+"""
+# benchmarks.py
+
+# Reproducible API benchmarks, run by `manage.py benchmark_api`. seed() builds a synthetic data
+# set from a fixed random seed with bulk inserts; each workload replays a scripted request (or
+# request pair) through the full Django stack with the test client, recording latency and
+# query count per iteration. Reports are plain JSON, so one run can be kept as a baseline and
+# later runs diffed against it with diff_reports(). run_deployments() compares the WSGI and
+# ASGI request models under concurrent load.
+
+import asyncio
+import platform
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+import django
+import httpx
+from django.contrib.auth.hashers import make_password
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from .cache import LocalLRUBackend
+from .counters import reconcile_plan_counters
+from .instrumentation import RequestRecord
+from .ledger import append_payment_changes, compact_ledger
+from .models import APIKey, Payment, Subscriber, SubscriptionPlan, User, Webhook
+from .webhooks import WebhookDispatcher, emit_events, percentiles
+
+PASSWORD = 'benchmark-password'
+SUBSCRIBER_STATUSES = ['active'] * 16 + ['cancelled'] * 2 + ['paused', 'past_due']
+PAYMENT_STATUSES = ['completed'] * 18 + ['failed', 'refunded']
+BATCH_SIZE = 5000
+
+# Run with local in-process backends (no Redis needed) and throttling that never rejects
+BENCHMARK_SETTINGS = {
+    'SUBCHAIN_RESPONSE_CACHE_BACKEND': 'subchain.cache.LocalLRUBackend',
+    'SUBCHAIN_THROTTLE_BACKEND': 'subchain.throttling.LocalTokenBucketBackend',
+    'SUBCHAIN_THROTTLE_RATES': {
+        tier: '1000000/s' for tier in ('anonymous', 'starter', 'pro', 'enterprise')
+    },
+}
+
+@dataclass
+class Scale:
+    merchants: int
+    plans: int  # per merchant
+    subscribers: int  # per plan
+    payments: int  # per subscriber
+    webhooks: int = 3  # per merchant
+
+SCALES = {
+    'small': Scale(merchants=5, plans=3, subscribers=100, payments=2),
+    'medium': Scale(merchants=20, plans=5, subscribers=500, payments=3),
+    'large': Scale(merchants=50, plans=5, subscribers=2_000, payments=4),
+}
+
+@dataclass
+class Merchant:
+    user: User
+    api_key: str
+    plan_ids: list
+    search_terms: list  # wallet address fragments that match subscribers
+
+def seeded_uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+def seed(scale, seed=0):
+    # Returns the seeded merchants. bulk_create() bypasses signals.py, so the ledger entries,
+    # plan counters and checkpoint are brought up to date here.
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    users = User.objects.bulk_create([
+        User(
+            id=seeded_uuid(rng),
+            username=f'merchant{index}@bench.example',
+            email=f'merchant{index}@bench.example',
+            password=password,
+            plan_tier='enterprise',
+        )
+        for index in range(scale.merchants)
+    ])
+    Webhook.objects.bulk_create([
+        Webhook(id=seeded_uuid(rng), user=user, url=f'https://hooks.bench.example/{index}', events=['*'])
+        for user in users
+        for index in range(scale.webhooks)
+    ])
+
+    merchants = []
+    for user in users:
+        plans = SubscriptionPlan.objects.bulk_create([
+            SubscriptionPlan(
+                id=seeded_uuid(rng),
+                user=user,
+                name=f'Plan {index}',
+                description=f'Benchmark plan {index}',
+                amount=Decimal(rng.choice([5, 10, 25, 50, 100])),
+                interval=rng.choice(['monthly', 'monthly', 'monthly', 'yearly']),
+                status='active',
+            )
+            for index in range(scale.plans)
+        ])
+        wallets = []
+        for plan in plans:
+            subscribers = [
+                Subscriber(
+                    id=seeded_uuid(rng),
+                    plan=plan,
+                    wallet_address=f'{rng.getrandbits(232):058X}',
+                    email=f'user{rng.getrandbits(40)}@example.com',
+                    status=rng.choice(SUBSCRIBER_STATUSES),
+                )
+                for _ in range(scale.subscribers)
+            ]
+            Subscriber.objects.bulk_create(subscribers, batch_size=BATCH_SIZE)
+            wallets.extend(subscriber.wallet_address for subscriber in subscribers[:5])
+
+            payments = [
+                Payment(
+                    id=seeded_uuid(rng),
+                    subscriber=subscriber,
+                    plan=plan,
+                    amount=plan.amount,
+                    status=rng.choice(PAYMENT_STATUSES),
+                )
+                for subscriber in subscribers
+                for _ in range(scale.payments)
+            ]
+            for start in range(0, len(payments), BATCH_SIZE):
+                batch = Payment.objects.bulk_create(payments[start:start + BATCH_SIZE])
+                append_payment_changes([(payment, None, payment.status) for payment in batch])
+
+        _, raw_key = APIKey.objects.create_key(user=user, name='benchmark')
+        merchants.append(Merchant(user, raw_key, [plan.pk for plan in plans], [wallet[:8] for wallet in wallets]))
+
+    reconcile_plan_counters()
+    compact_ledger()
+    return merchants
+
+WORKLOADS = {}
+
+def workload(name):
+    # Registers fn(client, merchant, rng) -> bool (True when the iteration succeeded)
+    def register(function):
+        WORKLOADS[name] = function
+        return function
+    return register
+
+def api(client, merchant, method, name, args=(), data=None):
+    url = reverse(name, args=args)
+    if method == 'get':
+        return client.get(url, data, HTTP_X_API_KEY=merchant.api_key)
+    return client.post(url, data or {}, content_type='application/json', HTTP_X_API_KEY=merchant.api_key)
+
+@workload('login')
+def login(client, merchant, rng):
+    credentials = {'email': merchant.user.email, 'password': PASSWORD}
+    return client.post(reverse('login'), credentials, content_type='application/json').status_code == 200
+
+@workload('plan_list')
+def plan_list(client, merchant, rng):
+    return api(client, merchant, 'get', 'plan-list').status_code == 200
+
+@workload('subscriber_search')
+def subscriber_search(client, merchant, rng):
+    term = rng.choice(merchant.search_terms)
+    return api(client, merchant, 'get', 'subscriber-list', data={'search': term}).status_code == 200
+
+@workload('analytics_overview')
+def analytics_overview(client, merchant, rng):
+    return api(client, merchant, 'get', 'analytics-overview').status_code == 200
+
+@workload('subscriber_create_cancel')
+def subscriber_create_cancel(client, merchant, rng):
+    created = api(client, merchant, 'post', 'subscriber-list', data={
+        'plan': str(rng.choice(merchant.plan_ids)),
+        'wallet_address': f'{rng.getrandbits(232):058X}',
+    })
+    if created.status_code != 201:
+        return False
+    return api(client, merchant, 'post', 'cancel-subscriber', args=[created.json()['id']]).status_code == 200
+
+@workload('webhook_fanout')
+def webhook_fanout(client, merchant, rng):
+    # One event to every webhook of the merchant, delivered by the dispatcher to a mock transport
+    events = emit_events([(merchant.user.pk, 'payment.completed', {'amount': '10.000000'})])
+    transport = httpx.MockTransport(lambda request: httpx.Response(200))
+
+    async def drain():
+        dispatcher = WebhookDispatcher(transport=transport)
+        try:
+            return await dispatcher.drain()
+        finally:
+            await dispatcher.aclose()
+
+    return asyncio.run(drain()) == len(events)
+
+def run_workload(name, merchants, iterations, rng, warmup=5):
+    function = WORKLOADS[name]
+    client = Client()
+    for index in range(warmup):
+        function(client, merchants[index % len(merchants)], rng)
+
+    latencies, queries, errors = [], [], 0
+    started = time.perf_counter()
+    for index in range(iterations):
+        record = RequestRecord()
+        begin = time.perf_counter()
+        with connection.execute_wrapper(record.time_query):
+            ok = function(client, merchants[index % len(merchants)], rng)
+        latencies.append(time.perf_counter() - begin)
+        queries.append(record.queries)
+        errors += not ok
+    elapsed = time.perf_counter() - started
+
+    summary = summarize(latencies, errors, elapsed)
+    summary['queries_per_iteration'] = round(sum(queries) / iterations, 2)
+    summary['max_queries'] = max(queries)
+    return summary
+
+def summarize(latencies, errors, elapsed):
+    summary = {
+        'iterations': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+    for point, value in percentiles(latencies).items():
+        summary[f'{point}_ms'] = round(value * 1000, 3)
+    return summary
+
+def run_workloads(merchants, names=None, iterations=200, seed=0):
+    rng = random.Random(seed)
+    return {name: run_workload(name, merchants, iterations, rng) for name in names or WORKLOADS}
+
+# Deployment comparison. Each scenario is served once by WSGIHandler on a fixed pool of worker
+# threads (a threaded WSGI server such as gunicorn --threads), and once by ASGIHandler on one
+# event loop (uvicorn), with `concurrency` clients keeping requests in flight. httpx's
+# in-process transports stand in for the network, so this compares the request models rather
+# than the servers' HTTP stacks. Both sides of a scenario return the same payload: the
+# overview through the sync view and its async_views variant, the streams through the same
+# async view, which WSGI runs on the worker thread and buffers.
+
+SERVER_SCENARIOS = {
+    # name: (WSGI route, ASGI route, query parameters)
+    'analytics_overview': ('analytics-overview', 'analytics-overview-async', {}),
+    'plan_stream': ('plan-stream', 'plan-stream', {}),
+    'subscriber_stream': ('subscriber-stream', 'subscriber-stream', {}),
+}
+
+class UncachedBackend(LocalLRUBackend):
+    # Response cache that stores nothing, so every request reaches the database
+    def __init__(self):
+        super().__init__(maxsize=0)
+
+DEPLOYMENT_SETTINGS = {
+    **BENCHMARK_SETTINGS,
+    'SUBCHAIN_RESPONSE_CACHE_BACKEND': 'subchain.benchmarks.UncachedBackend',
+}
+
+def scenario_requests(route, params, merchants, count):
+    url = f'http://testserver{reverse(route)}'
+    return [
+        httpx.Request('GET', url, params=params, headers={'X-API-Key': merchants[index % len(merchants)].api_key})
+        for index in range(count)
+    ]
+
+def serve_wsgi(requests, concurrency, threads):
+    # Clients beyond `threads` wait for a free worker, which stays busy until the body is read
+    transport = httpx.WSGITransport(app=WSGIHandler())
+    workers = threading.BoundedSemaphore(threads)
+
+    def send(request):
+        begin = time.perf_counter()
+        with workers:
+            response = transport.handle_request(request)
+            response.read()
+        return time.perf_counter() - begin, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = list(clients.map(send, requests))
+    return results, time.perf_counter() - started
+
+def serve_asgi(requests, concurrency):
+    transport = httpx.ASGITransport(app=ASGIHandler())
+
+    async def run():
+        pending, results = iter(requests), []
+
+        async def client():
+            for request in pending:
+                begin = time.perf_counter()
+                response = await transport.handle_async_request(request)
+                await response.aread()
+                results.append((time.perf_counter() - begin, response.status_code))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return results, time.perf_counter() - started
+
+    return asyncio.run(run())
+
+def run_deployments(merchants, names=None, requests=500, concurrency=64, threads=8, warmup=5):
+    # {scenario: {'wsgi': summary, 'asgi': summary}}; expects DEPLOYMENT_SETTINGS
+    def serve(server, batch):
+        if server == 'wsgi':
+            return serve_wsgi(batch, concurrency, threads)
+        return serve_asgi(batch, concurrency)
+
+    results = {}
+    for name in names or SERVER_SCENARIOS:
+        sync_route, async_route, params = SERVER_SCENARIOS[name]
+        results[name] = {}
+        for server, route in (('wsgi', sync_route), ('asgi', async_route)):
+            serve(server, scenario_requests(route, params, merchants, warmup))
+            timings, elapsed = serve(server, scenario_requests(route, params, merchants, requests))
+            errors = sum(status_code != 200 for _, status_code in timings)
+            results[name][server] = summarize([latency for latency, _ in timings], errors, elapsed)
+    return results
+
+def report(scale, seed, workloads, deployments=None):
+    return {
+        'meta': {
+            'scale': asdict(scale),
+            'seed': seed,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'created_at': timezone.now().isoformat(),
+        },
+        'workloads': workloads,
+        'deployments': deployments or {},
+    }
+
+# metric -> +1 when a higher value is worse, -1 when a lower one is
+COMPARED_METRICS = {
+    'p50_ms': 1,
+    'p95_ms': 1,
+    'p99_ms': 1,
+    'throughput': -1,
+    'queries_per_iteration': 1,
+}
+
+def diff_reports(baseline, current, threshold=0.15):
+    # [(workload, metric, baseline, current, relative change, regressed)] for workloads in both
+    # reports. Query counts are deterministic, so any increase is a regression.
+    rows = []
+    for name, metrics in current['workloads'].items():
+        before = baseline.get('workloads', {}).get(name)
+        if before is None:
+            continue
+        for metric, direction in COMPARED_METRICS.items():
+            old, new = before.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float('inf'))
+            limit = 0 if metric == 'queries_per_iteration' else threshold
+            rows.append((name, metric, old, new, change, change * direction > limit))
+    return rows
+"""
+
+"""
+# tasks.py
+
+from celery import shared_task
+from .archive import archive_old_rows
+from .billing import run_billing_cycle
+from .chain import reconcile_payments
+from .counters import reconcile_plan_counters
+from .ledger import compact_ledger
+from .rollups import reconcile_snapshots
+
+@shared_task(name='plans.reconcile_counters')
+def reconcile_plan_counters_task():
+    return reconcile_plan_counters()
+
+@shared_task(name='analytics.reconcile_snapshots')
+def reconcile_snapshots_task():
+    return reconcile_snapshots()
+
+@shared_task(name='billing.run_cycle')
+def run_billing_cycle_task():
+    # Safe to fan out: concurrent runs partition due subscribers with SKIP LOCKED
+    return run_billing_cycle()
+
+@shared_task(name='payments.reconcile_chain')
+def reconcile_chain_payments_task():
+    return reconcile_payments()
+
+@shared_task(name='ledger.compact')
+def compact_ledger_task():
+    checkpoint = compact_ledger()
+    return checkpoint.seq if checkpoint else None
+
+@shared_task(name='archive.run')
+def archive_old_rows_task():
+    return archive_old_rows()
+"""
+
+"""
+# management/commands/verify_ledger.py
+
+from django.core.management.base import BaseCommand, CommandError
+from ...ledger import verify_ledger
+
+class Command(BaseCommand):
+    help = 'Rebuild revenue totals from the payment ledger and diff them against the stored fields'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Rewrite the drifted totals')
+
+    def handle(self, *args, **options):
+        diffs = verify_ledger(fix=options['fix'])
+        for model, pk, stored, expected in diffs:
+            self.stdout.write(f'{model} {pk}: stored {stored}, ledger {expected}')
+        if diffs and not options['fix']:
+            raise CommandError(f'{len(diffs)} totals differ from the ledger')
+        self.stdout.write(self.style.SUCCESS(f'{len(diffs)} totals fixed' if diffs else 'Ledger and totals match'))
+"""
+
+"""
+# management/commands/benchmark_api.py
+
+# python manage.py benchmark_api --scale medium --output bench.json
+# python manage.py benchmark_api --scale medium --baseline bench.json   (fails on regressions)
+# python manage.py benchmark_api --workloads plan_list --deployments --scenarios plan_stream --concurrency 256
+#
+# Runs in a throwaway test database created from DATABASES (SQLite or a local PostgreSQL), so
+# the development data is never touched. --keepdb only saves creating and migrating it: the
+# previous run's rows are flushed before seeding, since seed() inserts deterministic keys.
+
+import json
+from dataclasses import replace
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from ...benchmarks import (
+    BENCHMARK_SETTINGS, DEPLOYMENT_SETTINGS, SCALES, SERVER_SCENARIOS, WORKLOADS, diff_reports, report,
+    run_deployments, run_workloads, seed,
+)
+
+class Command(BaseCommand):
+    help = 'Seed a synthetic data set and benchmark the REST API workloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+        parser.add_argument('--merchants', type=int)
+        parser.add_argument('--plans', type=int, help='Plans per merchant')
+        parser.add_argument('--subscribers', type=int, help='Subscribers per plan')
+        parser.add_argument('--payments', type=int, help='Payments per subscriber')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=200, help='Iterations per workload')
+        parser.add_argument('--workloads', help=f'Comma-separated subset of: {", ".join(WORKLOADS)}')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--baseline', help='Diff against this JSON report and fail on regressions')
+        parser.add_argument('--threshold', type=float, default=0.15, help='Tolerated relative slowdown')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the benchmark database (flushed, not re-created)')
+        parser.add_argument('--deployments', action='store_true', help='Also compare WSGI and ASGI under load')
+        parser.add_argument('--scenarios', help=f'Comma-separated subset of: {", ".join(SERVER_SCENARIOS)}')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario and deployment')
+        parser.add_argument('--concurrency', type=int, default=64, help='Clients with a request in flight')
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+
+    def handle(self, *args, **options):
+        scale = replace(SCALES[options['scale']], **{
+            field: options[field] for field in ('merchants', 'plans', 'subscribers', 'payments') if options[field]
+        })
+        names = options['workloads'].split(',') if options['workloads'] else list(WORKLOADS)
+        unknown = set(names) - set(WORKLOADS)
+        if unknown:
+            raise CommandError(f'Unknown workloads: {", ".join(sorted(unknown))}')
+        scenarios = options['scenarios'].split(',') if options['scenarios'] else list(SERVER_SCENARIOS)
+        unknown = set(scenarios) - set(SERVER_SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+        setup_test_environment()
+        databases = setup_databases(verbosity=options['verbosity'], interactive=False, keepdb=options['keepdb'])
+        try:
+            if options['keepdb']:
+                call_command('flush', interactive=False, verbosity=0)
+            with override_settings(**BENCHMARK_SETTINGS):
+                self.stdout.write(f'Seeding {scale}')
+                merchants = seed(scale, seed=options['seed'])
+                workloads = run_workloads(merchants, names, iterations=options['iterations'], seed=options['seed'])
+            deployments = None
+            if options['deployments']:
+                with override_settings(**DEPLOYMENT_SETTINGS):
+                    deployments = run_deployments(
+                        merchants, scenarios, requests=options['requests'],
+                        concurrency=options['concurrency'], threads=options['threads'],
+                    )
+            results = report(scale, options['seed'], workloads, deployments)
+        finally:
+            teardown_databases(databases, verbosity=options['verbosity'], keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        for name, metrics in results['workloads'].items():
+            self.stdout.write(
+                f'{name:<26} {metrics["throughput"]:>9.1f}/s  p50 {metrics["p50_ms"]:>8.2f} ms  '
+                f'p95 {metrics["p95_ms"]:>8.2f} ms  p99 {metrics["p99_ms"]:>8.2f} ms  '
+                f'{metrics["queries_per_iteration"]:>6.1f} queries  {metrics["errors"]} errors'
+            )
+        for name, servers in results['deployments'].items():
+            for server, metrics in servers.items():
+                self.stdout.write(
+                    f'{name + " " + server:<26} {metrics["throughput"]:>9.1f}/s  p50 {metrics["p50_ms"]:>8.2f} ms  '
+                    f'p95 {metrics["p95_ms"]:>8.2f} ms  p99 {metrics["p99_ms"]:>8.2f} ms  {metrics["errors"]} errors'
+                )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if options['baseline']:
+            with open(options['baseline']) as stored:
+                baseline = json.load(stored)
+            regressions = [row for row in diff_reports(baseline, results, options['threshold']) if row[-1]]
+            for name, metric, old, new, change, _ in regressions:
+                self.stdout.write(self.style.ERROR(f'{name} {metric}: {old} -> {new} ({change:+.0%})'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
+"""
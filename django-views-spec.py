@@ -5,9 +5,10 @@
 
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User, SubscriptionPlan, Subscriber, Payment, Webhook, APIKey
+from .instrumentation import TimedSerializerMixin
+from .models import User, SubscriptionPlan, Subscriber, Payment, Webhook, APIKey, ArchiveSegment
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email', 'first_name', 'last_name', 'wallet_address', 
@@ -54,14 +55,47 @@ class LoginSerializer(serializers.Serializer):
         
         return attrs
 
-class SubscriptionPlanSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    # ?fields=id,status,plan_name trims the representation on GET requests
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields()
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    def requested_fields(self):
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return None
+        raw = request.query_params.get('fields')
+        if not raw:
+            return None
+        return {name.strip() for name in raw.split(',') if name.strip()}
+
+class LedgerTailMixin:
+    # Adds the ledger tail annotated by ledger.with_*_tail() to the compacted stored total
+    ledger_tails = {}  # field name -> annotation name
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for field, annotation in self.ledger_tails.items():
+            tail = getattr(instance, annotation, None)
+            if tail and field in self.fields:
+                data[field] = self.fields[field].to_representation(getattr(instance, field) + tail)
+        return data
+
+class SubscriptionPlanSerializer(TimedSerializerMixin, LedgerTailMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    ledger_tails = {'total_revenue': 'revenue_tail'}
+
     class Meta:
         model = SubscriptionPlan
         fields = '__all__'
         read_only_fields = ['id', 'user', 'subscriber_count', 'total_revenue', 
                            'created_at', 'updated_at']
 
-class SubscriberSerializer(serializers.ModelSerializer):
+class SubscriberSerializer(TimedSerializerMixin, LedgerTailMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    ledger_tails = {'total_paid': 'paid_tail'}
     plan_name = serializers.CharField(source='plan.name', read_only=True)
     plan_amount = serializers.DecimalField(source='plan.amount', max_digits=10, 
                                           decimal_places=6, read_only=True)
@@ -72,7 +106,15 @@ class SubscriberSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['id', 'total_paid', 'created_at', 'updated_at']
 
-class PaymentSerializer(serializers.ModelSerializer):
+class SubscriberImportSerializer(serializers.ModelSerializer):
+    # Row rules for bulk imports: same model-derived validation as SubscriberSerializer, but the
+    # plan is fixed by the import and (plan, wallet_address) uniqueness is checked per chunk
+    class Meta:
+        model = Subscriber
+        fields = ['wallet_address', 'email', 'status', 'next_payment_date', 
+                 'payment_method', 'metadata']
+
+class PaymentSerializer(TimedSerializerMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     subscriber_wallet = serializers.CharField(source='subscriber.wallet_address', read_only=True)
     plan_name = serializers.CharField(source='plan.name', read_only=True)
 
@@ -81,34 +123,1019 @@ class PaymentSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ['id', 'created_at', 'updated_at']
 
-class WebhookSerializer(serializers.ModelSerializer):
+class WebhookSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Webhook
         fields = '__all__'
         read_only_fields = ['id', 'user', 'secret', 'last_triggered', 
                            'failure_count', 'created_at', 'updated_at']
 
-class APIKeySerializer(serializers.ModelSerializer):
+class APIKeySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # The full key only exists in the creation response; afterwards only the prefix is known
+    key = serializers.SerializerMethodField()
+
     class Meta:
         model = APIKey
-        fields = ['id', 'name', 'key', 'is_active', 'last_used', 
+        fields = ['id', 'name', 'key', 'prefix', 'is_active', 'last_used', 
                  'created_at', 'expires_at']
-        read_only_fields = ['id', 'key', 'last_used', 'created_at']
+        read_only_fields = ['id', 'prefix', 'last_used', 'created_at']
+
+    def get_key(self, obj):
+        return getattr(obj, 'raw_key', None)
+
+    def create(self, validated_data):
+        api_key, raw_key = APIKey.objects.create_key(**validated_data)
+        api_key.raw_key = raw_key
+        return api_key
+
+class ArchiveSegmentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = ArchiveSegment
+        fields = ['id', 'kind', 'period', 'row_count', 'first_created_at', 'last_created_at',
+                 'compressed_size', 'created_at']
+"""
+
+"""
+# cache.py
+
+# Per-user response cache for read-heavy endpoints. Entries are keyed by a per-user, per-scope
+# generation number: writes bump the generation (after commit) instead of deleting keys, so a
+# stale entry can never be served again and simply ages out. The TTL only reclaims memory.
+# Entries carry a TTL and generation keys do not, so Redis volatile-* eviction policies only
+# ever drop entries.
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.response import Response
+
+SCOPES = ('plans', 'analytics')
+# Responses relative to today (trailing windows, today's snapshot) are keyed by date as well,
+# so they turn over at midnight without a write
+DATED_SCOPES = ('analytics',)
+ENTRY_TTL = 24 * 3600  # seconds
+
+class LRUCache:
+    # Small thread-safe LRU with a per-entry TTL
+    def __init__(self, maxsize=10_000, ttl=60.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, self.clock() + (self.ttl if ttl is None else ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self.lock:
+            for key in [key for key, (value, _) in self.entries.items() if predicate(value)]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class LocalLRUBackend:
+    # In-process backend: only correct when a single process serves and writes
+    def __init__(self, maxsize=50_000, ttl=ENTRY_TTL):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value, ttl=ENTRY_TTL):
+        self.entries.set(key, value, ttl=ttl)
+
+    def get_generation(self, key):
+        return self.generations.get(key, 0)
+
+    def incr(self, key):
+        with self.lock:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            return self.generations[key]
+
+class RedisBackend:
+    # Shared backend over any client with the redis-py get/set(ex=)/incr interface
+    def __init__(self, client=None):
+        if client is None:
+            from django_redis import get_redis_connection
+
+            client = get_redis_connection('default')
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=ENTRY_TTL):
+        self.client.set(key, value, ex=ttl)
+
+    def get_generation(self, key):
+        return int(self.client.get(key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+class InMemoryRedis:
+    # Stand-in for a redis-py client in tests: same calls, same bytes in and out
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value, expires = self.data.get(key, (None, None))
+            if expires is not None and expires <= self.clock():
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            value = value if isinstance(value, bytes) else str(value).encode()
+            self.data[key] = (value, None if ex is None else self.clock() + ex)
+
+    def incr(self, key):
+        with self.lock:
+            value, expires = self.data.get(key, (b'0', None))
+            value = str(int(value) + 1).encode()
+            self.data[key] = (value, expires)
+            return int(value)
+
+    def flushall(self):
+        with self.lock:
+            self.data.clear()
+
+class InMemoryRedisBackend(RedisBackend):
+    client = InMemoryRedis()
+
+    def __init__(self):
+        super().__init__(client=InMemoryRedisBackend.client)
+
+_backends = {}
+
+def get_backend():
+    path = getattr(settings, 'SUBCHAIN_RESPONSE_CACHE_BACKEND', 'subchain.cache.LocalLRUBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+def generation_key(user_id, scope):
+    return f'response-cache:{user_id}:{scope}:generation'
+
+def invalidate(user_id, *scopes):
+    backend = get_backend()
+    for scope in scopes or SCOPES:
+        backend.incr(generation_key(user_id, scope))
+
+def invalidate_on_commit(user_ids, *scopes):
+    # Bumped after commit so a concurrent reader cannot cache pre-commit data under the new generation
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: [invalidate(user_id, *scopes) for user_id in user_ids])
+
+def entry_key(request, scope, generation):
+    path = hashlib.sha1(request.get_full_path().encode()).hexdigest()
+    if scope in DATED_SCOPES:
+        path = f'{timezone.localdate().isoformat()}:{path}'
+    return f'response-cache:{request.user.pk}:{scope}:{generation}:{path}'
+
+def make_etag(data):
+    body = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+    return body, '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+def lookup(request, scope):
+    # (key, stored entry or None) for the request under the scope's current generation
+    backend = get_backend()
+    key = entry_key(request, scope, backend.get_generation(generation_key(request.user.pk, scope)))
+    return key, backend.get(key)
+
+def store(key, data):
+    # Returns the ETag of the stored entry
+    body, etag = make_etag(data)
+    get_backend().set(key, f'{etag} {body}')
+    return etag
+
+def etag_response(request, etag, data):
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(data, headers=headers)
+
+def cached_response(request, scope, render):
+    # Serves GETs from the cache (or 304 on If-None-Match); render() builds a fresh Response
+    key, entry = lookup(request, scope)
+    if entry is not None:
+        etag, _, body = entry.partition(' ')
+        return etag_response(request, etag, json.loads(body))
+    response = render()
+    if response.status_code != status.HTTP_200_OK:
+        return response
+    return etag_response(request, store(key, response.data), response.data)
+
+async def acached_response(request, scope, render):
+    # cached_response() for async views: render() is awaited, the backend calls run in a thread
+    key, entry = await sync_to_async(lookup)(request, scope)
+    if entry is not None:
+        etag, _, body = entry.partition(' ')
+        return etag_response(request, etag, json.loads(body))
+    response = await render()
+    if response.status_code != status.HTTP_200_OK:
+        return response
+    return etag_response(request, await sync_to_async(store)(key, response.data), response.data)
+
+def cache_response(scope):
+    # For @api_view functions, sync or async, applied below @api_view so request.user is authenticated
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                return await acached_response(request, scope, lambda: view(request, *args, **kwargs))
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return cached_response(request, scope, lambda: view(request, *args, **kwargs))
+        return wrapper
+    return decorator
+
+class CachedResponseMixin:
+    # For generic views: GET goes through the per-user cache of cache_scope
+    cache_scope = None
+
+    def get(self, request, *args, **kwargs):
+        render = super().get
+        return cached_response(request, self.cache_scope, lambda: render(request, *args, **kwargs))
+"""
+
+"""
+# authentication.py
+
+import atexit
+import copy
+import hmac
+import threading
+import time
+import uuid
+from django.db import router
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from .cache import LRUCache
+from .models import API_KEY_PREFIX_LENGTH, APIKey, User, hash_api_key
+
+class LastUsedBuffer:
+    # Coalesces APIKey.last_used writes: requests only touch memory, and at most once per
+    # flush_interval the latest timestamps are written with a single bulk UPDATE
+    def __init__(self, flush_interval=60.0, clock=time.monotonic):
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.last_flush = clock()
+
+    def touch(self, key_id):
+        with self.lock:
+            self.pending[key_id] = timezone.now()
+            due = self.clock() - self.last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = self.clock()
+        if pending:
+            APIKey.objects.bulk_update(
+                [APIKey(pk=key_id, last_used=used) for key_id, used in pending.items()],
+                ['last_used'],
+            )
+
+# Per-process state. Other processes see revocations within the cache TTL;
+# the local process is invalidated immediately through signals.py
+api_key_cache = LRUCache()
+last_used_buffer = LastUsedBuffer()
+atexit.register(last_used_buffer.flush)
+
+def verify_api_key(raw_key):
+    # Returns the active, unexpired APIKey (with its user) matching raw_key, or None
+    digest = hash_api_key(raw_key)
+    api_key = api_key_cache.get(digest)
+    if api_key is None:
+        candidates = APIKey.objects.select_related('user').filter(
+            prefix=raw_key[:API_KEY_PREFIX_LENGTH], is_active=True
+        )
+        api_key = next(
+            (candidate for candidate in candidates if hmac.compare_digest(candidate.hashed_key, digest)),
+            None,
+        )
+        if api_key is None:
+            return None
+        api_key_cache.set(digest, api_key)
+
+    if api_key.expires_at is not None and api_key.expires_at <= timezone.now():
+        api_key_cache.delete(digest)
+        return None
+    if not api_key.user.is_active:
+        return None
+    # The cached instance is shared by every thread in the process; hand each request its own
+    # copies so request.user and request.auth can be mutated safely
+    api_key = copy.copy(api_key)
+    api_key.user = copy.copy(api_key.user)
+    return api_key
+
+class APIKeyAuthentication(BaseAuthentication):
+    # Authorization: Api-Key sk_live_... (or X-API-Key: sk_live_...)
+    keyword = 'Api-Key'
+
+    def get_raw_key(self, request):
+        header = get_authorization_header(request).split()
+        if header and header[0].lower() == self.keyword.lower().encode():
+            if len(header) != 2:
+                raise AuthenticationFailed('Invalid API key header')
+            return header[1].decode()
+        return request.META.get('HTTP_X_API_KEY')
+
+    def authenticate(self, request):
+        raw_key = self.get_raw_key(request)
+        if not raw_key:
+            return None
+        api_key = verify_api_key(raw_key)
+        if api_key is None:
+            raise AuthenticationFailed('Invalid or expired API key')
+        last_used_buffer.touch(api_key.pk)
+        return (api_key.user, api_key)
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+# Stateless JWT: access tokens carry the user id, the User.TOKEN_CLAIM_FIELDS and the
+# auth_version they were issued at, so request.user is built from the claims without loading
+# the row (only auth_version is read, at most once per TokenVersions ttl). Other fields are
+# deferred and loaded on first access. User.save() bumps
+# auth_version when a claim or the password changes; tokens below the latest version are
+# rejected and the client refreshes, which re-reads the user and issues fresh claims. Refresh
+# tokens also carry a digest of the password hash, so a password change retires them too.
+
+PASSWORD_CLAIM = 'password_digest'
+
+def token_claims(user):
+    return {**{name: getattr(user, name) for name in User.TOKEN_CLAIM_FIELDS}, 'auth_version': user.auth_version}
+
+class ClaimsRefreshToken(RefreshToken):
+    # Claims set on the refresh token are copied into each access token it issues, except the
+    # password digest, which only the refresh endpoint checks
+    no_copy_claims = (*RefreshToken.no_copy_claims, PASSWORD_CLAIM)
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for name, value in token_claims(user).items():
+            token[name] = value
+        token[PASSWORD_CLAIM] = user.get_session_auth_hash()
+        return token
+
+class TokenVersions:
+    # Lowest auth_version still accepted, per user: the User.auth_version column itself, the one
+    # record of a revocation that no cache can evict. Reads are kept in a local LRU for `ttl`
+    # seconds (an evicted entry is read again), so other processes reject a revoked token
+    # within ttl; this process does immediately through signals.py
+    def __init__(self, maxsize=100_000, ttl=5.0, clock=time.monotonic):
+        self.local = LRUCache(maxsize=maxsize, ttl=ttl, clock=clock)
+
+    def minimum(self, user_id):
+        # None when the user no longer exists
+        version = self.local.get(user_id)
+        if version is None:
+            version = User.objects.filter(pk=user_id).values_list('auth_version', flat=True).first()
+            if version is not None:
+                self.local.set(user_id, version)
+        return version
+
+    def revoke_before(self, user_id, version):
+        self.local.set(user_id, version)
+
+    def clear(self):
+        self.local.clear()
+
+token_versions = TokenVersions()
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        names = (jwt_settings.USER_ID_CLAIM, *User.TOKEN_CLAIM_FIELDS, 'auth_version')
+        if any(name not in validated_token for name in names):
+            # Issued before the claims were added: load the row
+            return super().get_user(validated_token)
+        try:
+            user_id = uuid.UUID(str(validated_token[jwt_settings.USER_ID_CLAIM]))
+        except ValueError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        if not validated_token['is_active']:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        minimum = token_versions.minimum(user_id)
+        if minimum is None or validated_token['auth_version'] < minimum:
+            raise InvalidToken('Token has been revoked')
+
+        claims = {name: validated_token[name] for name in (*User.TOKEN_CLAIM_FIELDS, 'auth_version')}
+        claims['id'] = user_id
+        # from_db() takes the values of a partial row in concrete field order
+        fields = [field.attname for field in User._meta.concrete_fields if field.attname in claims]
+        return User.from_db(router.db_for_read(User), fields, [claims[name] for name in fields])
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    # Re-reads the user so the new access token carries current claims. Refresh tokens issued
+    # before the latest password change (or without the digest) are rejected.
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        user_id = refresh.get(jwt_settings.USER_ID_CLAIM)
+        if user_id is None:
+            raise InvalidToken('Token contained no recognizable user identification')
+        user = User.objects.filter(pk=user_id).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        if not hmac.compare_digest(str(refresh.get(PASSWORD_CLAIM, '')), user.get_session_auth_hash()):
+            raise InvalidToken('Token has been revoked')
+        for name, value in token_claims(user).items():
+            refresh[name] = value
+        return super().validate({**attrs, 'refresh': str(refresh)})
+"""
+
+"""
+# throttling.py
+
+# Token-bucket rate limiting, keyed by API key (or by user for JWT/session requests) with the
+# bucket size scaled by the merchant's plan_tier. A rate of '600/min' allows bursts of 600
+# requests and refills continuously at 10 per second. The shared backend runs the whole
+# refill-and-take step as one Lua script, so workers cannot spend the same token twice.
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+from .models import APIKey
+
+DEFAULT_RATES = {
+    'anonymous': '30/min',
+    'starter': '60/min',
+    'pro': '600/min',
+    'enterprise': '6000/min',
+}
+PERIODS = {'s': 1, 'sec': 1, 'min': 60, 'hour': 3600, 'day': 86400}
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    # '600/min' -> (capacity, tokens refilled per second)
+    count, period = rate.split('/')
+    capacity = int(count)
+    return capacity, capacity / PERIODS[period]
+
+class LocalTokenBucketBackend:
+    # Process-local buckets: exact for a single process, and the in-memory stand-in for tests.
+    # Beyond maxsize the least recently used bucket is dropped; it has had the longest to refill
+    def __init__(self, maxsize=100_000, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key, capacity, refill_rate):
+        # Returns (allowed, tokens left after this request)
+        now = self.clock()
+        with self.lock:
+            state = self.buckets.get(key)
+            if state is None:
+                tokens = capacity
+            else:
+                self.buckets.move_to_end(key)
+                tokens = state[0] + (now - state[1]) * refill_rate
+                if tokens > capacity:
+                    tokens = capacity
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+        return allowed, tokens
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+class RedisTokenBucketBackend:
+    # Shared buckets in Redis: one EVALSHA round trip per request, timed by the Redis clock
+    SCRIPT = '''
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+local tokens = capacity
+if state[1] then
+    tokens = math.min(capacity, tonumber(state[1]) + math.max(0, now - tonumber(state[2])) * refill_rate)
+end
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'stamp', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / refill_rate) + 1)
+return {allowed, tostring(tokens)}
+'''
+
+    def __init__(self, client=None):
+        if client is None:
+            from django_redis import get_redis_connection
+
+            client = get_redis_connection('default')
+        self.script = client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, refill_rate):
+        allowed, tokens = self.script(keys=[key], args=[capacity, refill_rate])
+        return bool(allowed), float(tokens)
+
+_backends = {}
+
+def get_backend():
+    path = getattr(settings, 'SUBCHAIN_THROTTLE_BACKEND', 'subchain.throttling.LocalTokenBucketBackend')
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+class PlanTierThrottle(BaseThrottle):
+    # Also records the bucket state on the request for RateLimitHeadersMiddleware
+    def get_bucket(self, request):
+        user = request.user
+        if isinstance(request.auth, APIKey):
+            return f'throttle:key:{request.auth.pk}', user.plan_tier
+        if user.is_authenticated:
+            return f'throttle:user:{user.pk}', user.plan_tier
+        return f'throttle:anon:{self.get_ident(request)}', 'anonymous'
+
+    def allow_request(self, request, view):
+        key, tier = self.get_bucket(request)
+        rates = getattr(settings, 'SUBCHAIN_THROTTLE_RATES', DEFAULT_RATES)
+        capacity, refill_rate = parse_rate(rates.get(tier, rates['starter']))
+        allowed, tokens = get_backend().take(key, capacity, refill_rate)
+        self.wait_seconds = None if allowed else (1 - tokens) / refill_rate
+        request._request.rate_limit = (capacity, tokens, refill_rate)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+class RateLimitHeadersMiddleware:
+    # RateLimit-* headers (IETF draft names) on every throttled response; DRF adds Retry-After on 429
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.add_headers(request, await self.get_response(request))
+
+    def add_headers(self, request, response):
+        rate_limit = getattr(request, 'rate_limit', None)
+        if rate_limit is not None:
+            capacity, tokens, refill_rate = rate_limit
+            response['RateLimit-Limit'] = str(capacity)
+            response['RateLimit-Remaining'] = str(int(tokens))
+            response['RateLimit-Reset'] = str(math.ceil((capacity - tokens) / refill_rate))
+        return response
+"""
+
+"""
+# instrumentation.py
+
+# Per-route request metrics: latency, DB query count and time, serializer time and response
+# size, kept as cumulative histograms in process memory and served in the Prometheus text
+# format by metrics_view. A request costs a few perf_counter() calls, one execute_wrapper hop
+# per query and one lock acquisition; nothing leaves the process. Registries are per worker
+# process, so every worker has to be scraped (or aggregated by the collector).
+#
+# Sampled profiling: with SUBCHAIN_PROFILE_SAMPLE_RATE > 0 that fraction of requests runs under
+# cProfile, and profiles of requests slower than SUBCHAIN_PROFILE_SLOW_SECONDS are written to
+# SUBCHAIN_PROFILE_DIR (one .prof file per request, readable with pstats or snakeviz).
+
+import cProfile
+import hmac
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)  # bytes
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last slot is +Inf
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        # Cumulative (le, count) pairs, Prometheus style
+        total = 0
+        for bound, count in zip(self.bounds + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+class RouteMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.statuses = Counter()
+
+class RequestRecord:
+    # Filled in while one request runs. Queries may run on several threads at once
+    # (asyncdb.gather_queries), so their counters are updated under the record's lock.
+    __slots__ = ('queries', 'query_seconds', 'serializer_seconds', 'serializing', 'lock')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+        self.lock = threading.Lock()
+
+    def time_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.queries += 1
+                self.query_seconds += elapsed
+
+current_record = ContextVar('current_record', default=None)
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every connection (signals.py), so queries count towards the request in
+    # whichever thread they run: the WSGI worker, or sync_to_async() threads under ASGI
+    record = current_record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    return record.time_query(execute, sql, params, many, context)
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+class MetricsRegistry:
+    def __init__(self):
+        self.routes = {}  # (route, method) -> RouteMetrics
+        self.lock = threading.Lock()
+
+    def observe(self, route, method, status, latency, record, size):
+        with self.lock:
+            metrics = self.routes.get((route, method))
+            if metrics is None:
+                metrics = self.routes[(route, method)] = RouteMetrics()
+            metrics.latency.observe(latency)
+            metrics.queries.observe(record.queries)
+            metrics.query_seconds += record.query_seconds
+            metrics.serializer_seconds += record.serializer_seconds
+            metrics.statuses[status] += 1
+            if size is not None:
+                metrics.response_size.observe(size)
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+    def render(self):
+        with self.lock:
+            routes = sorted(self.routes.items())
+            lines = []
+            for name, kind, help_text, value in METRICS:
+                lines.append(f'# HELP subchain_{name} {help_text}')
+                lines.append(f'# TYPE subchain_{name} {kind}')
+                for (route, method), metrics in routes:
+                    labels = f'route="{route}",method="{method}"'
+                    if kind == 'histogram':
+                        histogram = value(metrics)
+                        for bound, count in histogram.samples():
+                            lines.append(f'subchain_{name}_bucket{{{labels},le="{bound}"}} {count}')
+                        lines.append(f'subchain_{name}_sum{{{labels}}} {histogram.sum}')
+                        lines.append(f'subchain_{name}_count{{{labels}}} {sum(histogram.counts)}')
+                    elif name == 'http_responses_total':
+                        for status, count in sorted(metrics.statuses.items()):
+                            lines.append(f'subchain_{name}{{{labels},status="{status}"}} {count}')
+                    else:
+                        lines.append(f'subchain_{name}{{{labels}}} {value(metrics)}')
+        lines.append('')
+        return chr(10).join(lines)
+
+# (name, type, help, accessor)
+METRICS = [
+    ('http_request_duration_seconds', 'histogram', 'Request latency by route.', lambda m: m.latency),
+    ('http_db_queries', 'histogram', 'Database queries per request by route.', lambda m: m.queries),
+    ('http_db_query_seconds_total', 'counter', 'Time spent in database queries.', lambda m: m.query_seconds),
+    ('http_serializer_seconds_total', 'counter', 'Time spent serializing responses.', lambda m: m.serializer_seconds),
+    ('http_response_size_bytes', 'histogram', 'Response body size (streaming excluded).', lambda m: m.response_size),
+    ('http_responses_total', 'counter', 'Responses by route and status code.', None),
+]
+
+registry = MetricsRegistry()
+
+class TimedSerializerMixin:
+    # Counts the outermost to_representation() towards the request's serializer time
+    def to_representation(self, instance):
+        record = current_record.get()
+        if record is None or record.serializing:
+            return super().to_representation(instance)
+        record.serializing = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            record.serializer_seconds += time.perf_counter() - started
+            record.serializing = False
+
+def start_profiler():
+    rate = getattr(settings, 'SUBCHAIN_PROFILE_SAMPLE_RATE', 0)
+    if not rate or random.random() >= rate:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # another profiler is already active in this process
+        return None
+    return profiler
+
+def finish_profiler(profiler, route, elapsed):
+    # elapsed includes the profiling overhead, so sampled requests cross the threshold earlier
+    profiler.disable()
+    directory = getattr(settings, 'SUBCHAIN_PROFILE_DIR', None)
+    if directory is None or elapsed < getattr(settings, 'SUBCHAIN_PROFILE_SLOW_SECONDS', 1.0):
+        return
+    os.makedirs(directory, exist_ok=True)
+    filename = f'{route}-{int(time.time() * 1000)}-{os.getpid()}.prof'
+    profiler.dump_stats(os.path.join(directory, filename))
+
+class RequestMetricsMiddleware:
+    # Sync and async capable, so ASGI requests to async views stay on the event loop
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        record = RequestRecord()
+        token = current_record.set(record)
+        profiler = start_profiler()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_record.reset(token)
+        self.observe(request, response, record, profiler, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        # Under ASGI a sampled profile also covers the requests interleaved on the event loop
+        record = RequestRecord()
+        token = current_record.set(record)
+        profiler = start_profiler()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_record.reset(token)
+        self.observe(request, response, record, profiler, time.perf_counter() - started)
+        return response
+
+    def observe(self, request, response, record, profiler, elapsed):
+        match = request.resolver_match
+        route = match.url_name if match is not None and match.url_name else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        registry.observe(route, request.method, response.status_code, elapsed, record, size)
+        if profiler is not None:
+            finish_profiler(profiler, route, elapsed)
+
+def metrics_view(request):
+    # Prometheus scrape endpoint, protected by a bearer token (SUBCHAIN_METRICS_TOKEN); without
+    # a configured token every request is refused
+    token = getattr(settings, 'SUBCHAIN_METRICS_TOKEN', None)
+    if not token or not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+"""
+
+"""
+# asyncdb.py
+
+# Concurrent ORM reads for async views. sync_to_async() runs all of a request's queries on its
+# one thread-sensitive worker, one after another; gather_queries() runs each call on its own
+# pool thread, hence its own connection, so independent queries overlap. Only for reads that
+# do not need the caller's transaction. Under ASGI keep CONN_MAX_AGE at 0 with PgBouncer in
+# front in session pooling mode: pool threads then borrow a pooled connection per call, and
+# the server-side cursors behind the streamed lists keep working (transaction pooling would
+# need DISABLE_SERVER_SIDE_CURSORS, which makes aiterator() fetch every row up front).
+
+import asyncio
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+def on_own_connection(function):
+    def run(*args):
+        try:
+            return function(*args)
+        finally:
+            # Pool threads never see request_finished, which normally closes the connection
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+async def gather_queries(*calls):
+    # calls are (function, *args) tuples; results come back in the same order
+    return await asyncio.gather(*(on_own_connection(function)(*args) for function, *args in calls))
+"""
+
+"""
+# pagination.py
+
+import base64
+import json
+import uuid
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+class KeysetPagination(BasePagination):
+    # Opaque forward cursor on (created_at, id). Each page is an index range scan,
+    # so page 10,000 costs the same as page 1 (no OFFSET, no COUNT)
+    page_size = 20
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-created_at', '-id')
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            created_at, pk = position
+            # Equivalent to (created_at, id) < (x, y); the first term bounds the index range
+            queryset = queryset.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(id__lt=pk)
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            created_at = parse_datetime(position['t'])
+            pk = uuid.UUID(position['id'])
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, pk
+
+    def encode_cursor(self, row):
+        position = json.dumps({'t': row.created_at.isoformat(), 'id': str(row.pk)})
+        encoded = base64.urlsafe_b64encode(position.encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
 """
 
 """
 # views.py
 
 from rest_framework import generics, status, permissions
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, parser_classes, permission_classes
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db.models import Q, Sum, Count
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from datetime import timedelta
-from .models import User, SubscriptionPlan, Subscriber, Payment, Webhook, APIKey
+from .models import User, SubscriptionPlan, Subscriber, Payment, Webhook, APIKey, ArchiveSegment
 from .serializers import *
+from .archive import find_archived, stream_segment
+from .authentication import ClaimsRefreshToken
+from .cache import CachedResponseMixin, cache_response
+from .cohorts import compute_cohorts
+from .ledger import with_paid_tail, with_revenue_tail
+from .pagination import KeysetPagination
+from .search import get_search_backend
+from .rollups import metrics_timeseries, overview_from_snapshots
+from .subscriber_io import EXPORT_FORMATS, export_rows, import_subscribers, read_rows
 
 # Authentication Views
 class RegisterView(generics.CreateAPIView):
@@ -121,7 +1148,7 @@ class RegisterView(generics.CreateAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
         
-        refresh = RefreshToken.for_user(user)
+        refresh = ClaimsRefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
             'access': str(refresh.access_token),
@@ -137,7 +1164,7 @@ class LoginView(generics.GenericAPIView):
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
         
-        refresh = RefreshToken.for_user(user)
+        refresh = ClaimsRefreshToken.for_user(user)
         return Response({
             'user': UserSerializer(user).data,
             'access': str(refresh.access_token),
@@ -149,13 +1176,45 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        user = self.request.user
+        deferred = user.get_deferred_fields()
+        if deferred:
+            # Built from token claims: load the remaining fields in one query, not one per field
+            user.refresh_from_db(fields=deferred)
+        return user
 
-# Plan Views
-class PlanListCreateView(generics.ListCreateAPIView):
-    serializer_class = SubscriptionPlanSerializer
-    permission_classes = [permissions.IsAuthenticated]
+# Query optimisation
+class OptimizedQuerysetMixin:
+    # Related objects read by the serializer, joined into the list query
+    select_related_fields = ()
+
+    def optimize_queryset(self, queryset):
+        serializer = self.get_serializer()
+        requested = serializer.requested_fields()
+        if not requested:
+            if self.select_related_fields:
+                queryset = queryset.select_related(*self.select_related_fields)
+            return queryset
 
+        # Only SELECT the columns behind the requested fields, e.g. plan_name -> plan__name
+        columns, relations = set(), set()
+        for field in serializer.fields.values():
+            if field.source == '*':
+                continue
+            path = field.source.split('.')
+            columns.add('__'.join(path))
+            for depth in range(1, len(path)):
+                relations.add('__'.join(path[:depth]))
+
+        queryset = queryset.select_related(None)
+        if relations:
+            queryset = queryset.select_related(*relations)
+        # created_at is always loaded: the pagination cursor is built from it
+        return queryset.only('created_at', *columns, *relations)
+
+# Plan Views
+class PlanListQueryMixin(OptimizedQuerysetMixin):
+    # Filters shared by the paginated list and async_views.PlanStreamView
     def get_queryset(self):
         queryset = SubscriptionPlan.objects.filter(user=self.request.user)
         status_filter = self.request.query_params.get('status')
@@ -164,21 +1223,38 @@ class PlanListCreateView(generics.ListCreateAPIView):
         if status_filter:
             queryset = queryset.filter(status=status_filter)
         if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | Q(description__icontains=search)
-            )
+            queryset = get_search_backend().filter_plans(queryset, search)
         
-        return queryset
+        return with_revenue_tail(self.optimize_queryset(queryset))
+
+class PlanListCreateView(CachedResponseMixin, PlanListQueryMixin, generics.ListCreateAPIView):
+    serializer_class = SubscriptionPlanSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    cache_scope = 'plans'
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class PlanDetailView(generics.RetrieveUpdateDestroyAPIView):
+class PlanDetailView(CachedResponseMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = SubscriptionPlanSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_scope = 'plans'
 
     def get_queryset(self):
-        return SubscriptionPlan.objects.filter(user=self.request.user)
+        return with_revenue_tail(SubscriptionPlan.objects.filter(user=self.request.user))
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def search_plans(request):
+    # Ranked full-text search over plan names and descriptions
+    term = request.query_params.get('q', '').strip()
+    if not term:
+        return Response({'results': []})
+    plans = get_search_backend().rank_plans(
+        SubscriptionPlan.objects.filter(user=request.user), term
+    )
+    return Response({'results': SubscriptionPlanSerializer(plans, many=True).data})
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -203,9 +1279,9 @@ def deactivate_plan(request, pk):
         return Response({'error': 'Plan not found'}, status=404)
 
 # Subscriber Views
-class SubscriberListCreateView(generics.ListCreateAPIView):
-    serializer_class = SubscriberSerializer
-    permission_classes = [permissions.IsAuthenticated]
+class SubscriberListQueryMixin(OptimizedQuerysetMixin):
+    # Filters shared by the paginated list and async_views.SubscriberStreamView
+    select_related_fields = ('plan',)
 
     def get_queryset(self):
         user_plans = SubscriptionPlan.objects.filter(user=self.request.user)
@@ -220,22 +1296,22 @@ class SubscriberListCreateView(generics.ListCreateAPIView):
         if plan_filter:
             queryset = queryset.filter(plan=plan_filter)
         if search:
-            queryset = queryset.filter(
-                Q(wallet_address__icontains=search) | Q(email__icontains=search)
-            )
+            queryset = get_search_backend().filter_subscribers(queryset, search)
         
-        return queryset
+        return with_paid_tail(self.optimize_queryset(queryset))
+
+class SubscriberListCreateView(SubscriberListQueryMixin, generics.ListCreateAPIView):
+    serializer_class = SubscriberSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def perform_create(self, serializer):
         plan = serializer.validated_data['plan']
         if plan.user != self.request.user:
             raise serializers.ValidationError("Plan not found")
         
-        subscriber = serializer.save()
-        
-        # Update plan statistics
-        plan.subscriber_count += 1
-        plan.save()
+        # Plan statistics are maintained atomically by the post_save signal
+        serializer.save()
 
 class SubscriberDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = SubscriberSerializer
@@ -243,7 +1319,7 @@ class SubscriberDetailView(generics.RetrieveUpdateDestroyAPIView):
 
     def get_queryset(self):
         user_plans = SubscriptionPlan.objects.filter(user=self.request.user)
-        return Subscriber.objects.filter(plan__in=user_plans)
+        return with_paid_tail(Subscriber.objects.filter(plan__in=user_plans).select_related('plan'))
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -251,73 +1327,134 @@ def cancel_subscriber(request, pk):
     try:
         user_plans = SubscriptionPlan.objects.filter(user=request.user)
         subscriber = Subscriber.objects.get(pk=pk, plan__in=user_plans)
+        # Plan statistics follow the status transition via the post_save signal
         subscriber.status = 'cancelled'
         subscriber.save()
         
-        # Update plan statistics
-        subscriber.plan.subscriber_count = max(0, subscriber.plan.subscriber_count - 1)
-        subscriber.plan.save()
-        
         return Response(SubscriberSerializer(subscriber).data)
     except Subscriber.DoesNotExist:
         return Response({'error': 'Subscriber not found'}, status=404)
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@parser_classes([MultiPartParser])
+def import_subscribers_view(request):
+    # multipart: file=<.csv | .ndjson>, plan=<uuid>; rows are parsed and inserted chunk by chunk
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'error': 'file is required'}, status=400)
+    try:
+        plan = SubscriptionPlan.objects.get(pk=request.data.get('plan'), user=request.user)
+    except (SubscriptionPlan.DoesNotExist, ValueError, DjangoValidationError):
+        return Response({'error': 'Plan not found'}, status=404)
+
+    file_format = request.data.get('as') or ('ndjson' if upload.name.endswith(('.ndjson', '.jsonl')) else 'csv')
+    if file_format not in EXPORT_FORMATS:
+        return Response({'error': f'Unsupported format: {file_format}'}, status=400)
+    return Response(import_subscribers(plan, read_rows(upload, file_format)))
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_subscribers_view(request):
+    # ?as=csv|ndjson, same plan/status filters as the list; streamed, never held in memory
+    file_format = request.query_params.get('as', 'csv')
+    if file_format not in EXPORT_FORMATS:
+        return Response({'error': f'Unsupported format: {file_format}'}, status=400)
+
+    queryset = Subscriber.objects.filter(plan__user=request.user)
+    if request.query_params.get('status'):
+        queryset = queryset.filter(status=request.query_params['status'])
+    if request.query_params.get('plan'):
+        queryset = queryset.filter(plan=request.query_params['plan'])
+
+    content_type, extension = EXPORT_FORMATS[file_format]
+    response = StreamingHttpResponse(export_rows(queryset, file_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="subscribers.{extension}"'
+    return response
+
+# Payment Views
+class PaymentListView(OptimizedQuerysetMixin, generics.ListAPIView):
+    serializer_class = PaymentSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    select_related_fields = ('subscriber', 'plan')
+
+    def get_queryset(self):
+        user_plans = SubscriptionPlan.objects.filter(user=self.request.user)
+        queryset = Payment.objects.filter(plan__in=user_plans)
+
+        status_filter = self.request.query_params.get('status')
+        plan_filter = self.request.query_params.get('plan')
+        subscriber_filter = self.request.query_params.get('subscriber')
+
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        if plan_filter:
+            queryset = queryset.filter(plan=plan_filter)
+        if subscriber_filter:
+            queryset = queryset.filter(subscriber=subscriber_filter)
+
+        return self.optimize_queryset(queryset)
+
+# Archive Views
+class ArchiveSegmentListView(generics.ListAPIView):
+    serializer_class = ArchiveSegmentSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = ArchiveSegment.objects.filter(user=self.request.user)
+        kind = self.request.query_params.get('kind')
+        if kind:
+            queryset = queryset.filter(kind=kind)
+        return queryset
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def archive_segment_download(request, pk):
+    # The segment's rows as NDJSON, decompressed on the fly
+    segment = get_object_or_404(ArchiveSegment, pk=pk, user=request.user)
+    response = StreamingHttpResponse(stream_segment(segment), content_type='application/x-ndjson')
+    response['Content-Disposition'] = f'attachment; filename="{segment.kind}-{segment.period:%Y-%m}-{segment.pk}.ndjson"'
+    return response
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def archived_record(request, pk):
+    row = find_archived(pk, request.user)
+    if row is None:
+        raise Http404
+    return Response(row)
+
 # Analytics Views
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
+@cache_response('analytics')
 def analytics_overview(request):
-    user_plans = SubscriptionPlan.objects.filter(user=request.user)
-    subscribers = Subscriber.objects.filter(plan__in=user_plans)
-    payments = Payment.objects.filter(plan__in=user_plans, status='completed')
-    
-    # Basic metrics
-    total_subscribers = subscribers.count()
-    active_subscribers = subscribers.filter(status='active').count()
-    cancelled_subscribers = subscribers.filter(status='cancelled').count()
-    paused_subscribers = subscribers.filter(status='paused').count()
-    
-    # Revenue metrics
-    total_revenue = payments.aggregate(Sum('amount'))['amount__sum'] or 0
-    
-    # MRR calculation (simplified)
-    monthly_plans = user_plans.filter(interval='monthly')
-    yearly_plans = user_plans.filter(interval='yearly')
-    
-    mrr = 0
-    for plan in monthly_plans:
-        active_subs = subscribers.filter(plan=plan, status='active').count()
-        mrr += active_subs * plan.amount
-    
-    for plan in yearly_plans:
-        active_subs = subscribers.filter(plan=plan, status='active').count()
-        mrr += active_subs * (plan.amount / 12)
-    
-    arr = mrr * 12
-    
-    # Churn rate (simplified - last 30 days)
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    churned_last_month = subscribers.filter(
-        status='cancelled',
-        updated_at__gte=thirty_days_ago
-    ).count()
-    
-    churn_rate = (churned_last_month / max(total_subscribers, 1)) * 100
-    
-    # ARPU
-    arpu = total_revenue / max(active_subscribers, 1)
-    
-    return Response({
-        'total_subscribers': total_subscribers,
-        'active_subscribers': active_subscribers,
-        'cancelled_subscribers': cancelled_subscribers,
-        'paused_subscribers': paused_subscribers,
-        'mrr': float(mrr),
-        'arr': float(arr),
-        'churn_rate': churn_rate,
-        'total_revenue': float(total_revenue),
-        'average_revenue_per_user': float(arpu),
-        'growth_rate': 0,  # Implement based on historical data
-    })
+    return Response(overview_from_snapshots(request.user.pk))
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@cache_response('analytics')
+def analytics_timeseries(request):
+    try:
+        days = int(request.query_params.get('days', 30))
+    except ValueError:
+        return Response({'error': 'days must be an integer'}, status=400)
+
+    days = min(max(days, 1), 730)
+    return Response(metrics_timeseries(request.user.pk, days))
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@cache_response('analytics')
+def analytics_cohorts(request):
+    try:
+        months = int(request.query_params.get('months', 24))
+    except ValueError:
+        return Response({'error': 'months must be an integer'}, status=400)
+
+    months = min(max(months, 1), 60)
+    return Response(compute_cohorts(request.user.pk, months))
 
 # Webhook Views
 class WebhookListCreateView(generics.ListCreateAPIView):
@@ -342,39 +1479,128 @@ class APIKeyListCreateView(generics.ListCreateAPIView):
         serializer.save(user=self.request.user)
 """
 
+"""
+# async_views.py
+
+# ASGI-native variants of the read-heavy endpoints. Served by an ASGI server they run on the
+# event loop: the overview's independent queries run concurrently (asyncdb.gather_queries) and
+# lists are streamed from a server-side cursor, so a slow client holds a coroutine instead of
+# a worker thread. Authentication, permissions and throttling are the usual DRF classes, run
+# by adrf. Under WSGI they still work, but Django buffers the streamed lists. The cursor needs
+# a session-pooled connection, see asyncdb.py.
+
+import json
+from adrf.decorators import api_view
+from adrf.views import APIView
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework import permissions
+from rest_framework.decorators import permission_classes
+from rest_framework.response import Response
+from .cache import cache_response
+from .rollups import aoverview_from_snapshots
+from .serializers import SubscriberSerializer, SubscriptionPlanSerializer
+from .views import PlanListQueryMixin, SubscriberListQueryMixin
+
+STREAM_CHUNK_SIZE = 500  # rows per cursor fetch and per chunk written to the client
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@cache_response('analytics')
+async def analytics_overview(request):
+    return Response(await aoverview_from_snapshots(request.user.pk))
+
+async def stream_results(queryset, serialize):
+    # {"results": [...]} with every row of the queryset, one chunk of rows at a time
+    yield '{"results":['
+    separator, rows = '', []
+    async for instance in queryset.aiterator(chunk_size=STREAM_CHUNK_SIZE):
+        rows.append(json.dumps(serialize(instance), cls=DjangoJSONEncoder))
+        if len(rows) == STREAM_CHUNK_SIZE:
+            yield separator + ','.join(rows)
+            separator, rows = ',', []
+    if rows:
+        yield separator + ','.join(rows)
+    yield ']}'
+
+class StreamingListView(APIView):
+    # GET streams every matching row, newest first; same filters and ?fields= as the list view
+    serializer_class = None
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_serializer(self, *args, **kwargs):
+        return self.serializer_class(*args, context={'request': self.request, 'view': self}, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        # Building the queryset runs no query; related rows come from select_related, as
+        # lazy loads are not allowed on the event loop
+        queryset = self.get_queryset().order_by('-created_at', '-id')
+        serializer = self.get_serializer()
+        return StreamingHttpResponse(
+            stream_results(queryset, serializer.to_representation), content_type='application/json'
+        )
+
+class PlanStreamView(PlanListQueryMixin, StreamingListView):
+    serializer_class = SubscriptionPlanSerializer
+
+class SubscriberStreamView(SubscriberListQueryMixin, StreamingListView):
+    serializer_class = SubscriberSerializer
+"""
+
 """
 # urls.py
 
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
-from . import views
+from . import async_views, views
+from .authentication import ClaimsTokenRefreshSerializer
+from .instrumentation import metrics_view
 
 urlpatterns = [
     # Authentication
     path('auth/register/', views.RegisterView.as_view(), name='register'),
     path('auth/login/', views.LoginView.as_view(), name='login'),
-    path('auth/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('auth/refresh/', TokenRefreshView.as_view(serializer_class=ClaimsTokenRefreshSerializer), name='token_refresh'),
     path('auth/profile/', views.ProfileView.as_view(), name='profile'),
     
     # Plans
     path('plans/', views.PlanListCreateView.as_view(), name='plan-list'),
+    path('plans/search/', views.search_plans, name='plan-search'),
+    path('plans/stream/', async_views.PlanStreamView.as_view(), name='plan-stream'),
     path('plans/<uuid:pk>/', views.PlanDetailView.as_view(), name='plan-detail'),
     path('plans/<uuid:pk>/activate/', views.activate_plan, name='activate-plan'),
     path('plans/<uuid:pk>/deactivate/', views.deactivate_plan, name='deactivate-plan'),
     
     # Subscribers
     path('subscribers/', views.SubscriberListCreateView.as_view(), name='subscriber-list'),
+    path('subscribers/import/', views.import_subscribers_view, name='subscriber-import'),
+    path('subscribers/export/', views.export_subscribers_view, name='subscriber-export'),
+    path('subscribers/stream/', async_views.SubscriberStreamView.as_view(), name='subscriber-stream'),
     path('subscribers/<uuid:pk>/', views.SubscriberDetailView.as_view(), name='subscriber-detail'),
     path('subscribers/<uuid:pk>/cancel/', views.cancel_subscriber, name='cancel-subscriber'),
     
+    # Payments
+    path('payments/', views.PaymentListView.as_view(), name='payment-list'),
+    
+    # Archive (payments and webhook events moved to cold storage)
+    path('archive/', views.ArchiveSegmentListView.as_view(), name='archive-segment-list'),
+    path('archive/<int:pk>/', views.archive_segment_download, name='archive-segment-download'),
+    path('archive/records/<uuid:pk>/', views.archived_record, name='archived-record'),
+    
     # Analytics
     path('analytics/overview/', views.analytics_overview, name='analytics-overview'),
+    path('analytics/overview/async/', async_views.analytics_overview, name='analytics-overview-async'),
+    path('analytics/timeseries/', views.analytics_timeseries, name='analytics-timeseries'),
+    path('analytics/cohorts/', views.analytics_cohorts, name='analytics-cohorts'),
     
     # Webhooks
     path('webhooks/', views.WebhookListCreateView.as_view(), name='webhook-list'),
     
     # API Keys
     path('api-keys/', views.APIKeyListCreateView.as_view(), name='apikey-list'),
+
+    # Monitoring
+    path('metrics/', metrics_view, name='metrics'),
 ]
 """
@@ -0,0 +1,488 @@
+# Spécifications de la livraison des webhooks Django pour SubChain
+# À utiliser comme référence pour le dispatcher asynchrone des WebhookEvent
+
+"""
+# webhooks.py
+
+import asyncio
+import hashlib
+import hmac
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Webhook, WebhookEvent
+
+SIGNATURE_HEADER = 'X-SubChain-Signature'
+TIMESTAMP_HEADER = 'X-SubChain-Timestamp'
+EVENT_HEADER = 'X-SubChain-Event'
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 2  # seconds
+BACKOFF_CAP = 3600  # seconds
+# A claimed batch is invisible to other dispatchers for this long, then retried
+CLAIM_LEASE = timedelta(minutes=5)
+RESPONSE_BODY_LIMIT = 1000
+
+def sign_payload(secret, timestamp, body):
+    message = timestamp.encode() + b'.' + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+def verify_signature(secret, timestamp, body, signature):
+    # For merchants: recompute the HMAC and compare in constant time
+    return hmac.compare_digest(sign_payload(secret, timestamp, body), signature)
+
+def backoff_delay(attempts):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempts))
+
+def emit_event(user, event_type, payload):
+    # One pending WebhookEvent per active webhook subscribed to event_type (or '*')
+    return emit_events([(user.pk, event_type, payload)])
+
+def emit_events(events):
+    # Batched emit_event for (user_id, event_type, payload) tuples: one SELECT, one INSERT
+    events = list(events)
+    if not events:
+        return []
+    webhooks_by_user = defaultdict(list)
+    webhooks = Webhook.objects.filter(
+        user_id__in={user_id for user_id, _, _ in events}, is_active=True
+    ).only('id', 'user_id', 'events')
+    for webhook in webhooks:
+        webhooks_by_user[webhook.user_id].append(webhook)
+
+    return WebhookEvent.objects.bulk_create([
+        WebhookEvent(webhook=webhook, event_type=event_type, payload=payload)
+        for user_id, event_type, payload in events
+        for webhook in webhooks_by_user[user_id]
+        if event_type in webhook.events or '*' in webhook.events
+    ], batch_size=1000)
+
+@dataclass
+class DeliveryResult:
+    event_id: object
+    webhook_id: object
+    # delivered, retry (failed attempt, rescheduled), failed (gave up) or deferred (not attempted)
+    outcome: str
+    status: str
+    attempts: int
+    response_status: Optional[int]
+    response_body: str
+    next_attempt_at: datetime
+    delivered_at: Optional[datetime]
+    latency: Optional[float]
+
+def claim_batch(batch_size, due_before, exclude_webhooks=()):
+    # SELECT ... FOR UPDATE SKIP LOCKED, then lease the rows, so several
+    # dispatcher processes can drain the queue without delivering an event twice.
+    # Events of webhooks whose circuit is open are left in the table untouched
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('webhook')
+            .filter(status='pending', next_attempt_at__lte=due_before, webhook__is_active=True)
+            .exclude(webhook_id__in=list(exclude_webhooks))
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            next_attempt_at=now + CLAIM_LEASE
+        )
+    return events
+
+def save_results(results):
+    # Bulk write-back: one CASE/WHEN UPDATE for the events, a few grouped UPDATEs for webhooks
+    now = timezone.now()
+    WebhookEvent.objects.bulk_update(
+        [
+            WebhookEvent(
+                id=result.event_id,
+                status=result.status,
+                attempts=result.attempts,
+                response_status=result.response_status,
+                response_body=result.response_body,
+                next_attempt_at=result.next_attempt_at,
+                delivered_at=result.delivered_at,
+            )
+            for result in results
+        ],
+        ['status', 'attempts', 'response_status', 'response_body', 'next_attempt_at', 'delivered_at'],
+        batch_size=500,
+    )
+
+    delivered = {result.webhook_id for result in results if result.outcome == 'delivered'}
+    if delivered:
+        Webhook.objects.filter(pk__in=delivered).update(last_triggered=now, failure_count=0)
+
+    failures = Counter(
+        result.webhook_id for result in results if result.outcome in ('retry', 'failed')
+    )
+    by_count = defaultdict(list)
+    for webhook_id, count in failures.items():
+        if webhook_id not in delivered:
+            by_count[count].append(webhook_id)
+    for count, webhook_ids in by_count.items():
+        Webhook.objects.filter(pk__in=webhook_ids).update(failure_count=F('failure_count') + count)
+
+def percentiles(samples, points=(50, 95, 99)):
+    if not samples:
+        return {f'p{point}': None for point in points}
+    ordered = sorted(samples)
+    last = len(ordered) - 1
+    return {f'p{point}': ordered[min(last, round(last * point / 100))] for point in points}
+
+class CircuitBreaker:
+    # Per-webhook breaker. Opens after failure_threshold consecutive failures (seeded from
+    # Webhook.failure_count) or when the recent p95 latency exceeds slow_call_threshold.
+    # After a cooldown that doubles on every consecutive trip, one probe is let through
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, slow_call_threshold=5.0, window=50,
+                 cooldown=30.0, max_cooldown=3600.0, initial_failures=0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+        self.latencies = deque(maxlen=window)
+        self.failures = initial_failures
+        self.trips = 0
+        self.retry_at = 0.0
+        self.probe_in_flight = False
+        # A webhook that was already failing starts with a single probe, not a full batch
+        self.state = self.HALF_OPEN if initial_failures >= failure_threshold else self.CLOSED
+
+    def is_open(self):
+        return self.state == self.OPEN and self.clock() < self.retry_at
+
+    def seconds_until_retry(self):
+        return max(0.0, self.retry_at - self.clock())
+
+    def allow_request(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if self.clock() < self.retry_at:
+                return False
+            self.state = self.HALF_OPEN
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        self.failures = 0
+        if self.state == self.HALF_OPEN:
+            self.state, self.probe_in_flight, self.trips = self.CLOSED, False, 0
+        elif self.state == self.CLOSED and self.is_slow():
+            self.trip()
+
+    def record_failure(self, latency):
+        # Deliveries already in flight when the breaker tripped fail after it opened;
+        # they say nothing new about the endpoint and must not extend the cooldown
+        if self.state == self.OPEN:
+            return
+        if latency is not None:
+            self.latencies.append(latency)
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.trip()
+
+    def is_slow(self):
+        if len(self.latencies) < self.latencies.maxlen // 2:
+            return False
+        return percentiles(self.latencies, points=(95,))['p95'] > self.slow_call_threshold
+
+    def trip(self):
+        self.trips += 1
+        self.state, self.probe_in_flight = self.OPEN, False
+        self.retry_at = self.clock() + min(self.max_cooldown, self.cooldown * 2 ** (self.trips - 1))
+        self.latencies.clear()
+
+class DeliveryMetrics:
+    # In-process gauges and rolling latency windows, read through snapshot()
+    def __init__(self, window=2048):
+        self.window = window
+        self.outcomes = Counter()
+        self.queue_depth = {}
+        self.latencies = deque(maxlen=window)
+        self.endpoint_latencies = defaultdict(lambda: deque(maxlen=window))
+
+    def set_queue_depth(self, webhook_id, depth):
+        self.queue_depth[webhook_id] = depth
+
+    def observe(self, result):
+        self.outcomes[result.outcome] += 1
+        if result.latency is not None:
+            self.latencies.append(result.latency)
+            self.endpoint_latencies[result.webhook_id].append(result.latency)
+
+    def snapshot(self):
+        return {
+            'outcomes': dict(self.outcomes),
+            'queue_depth': {
+                'total': sum(self.queue_depth.values()),
+                'max': max(self.queue_depth.values(), default=0),
+            },
+            'latency': percentiles(self.latencies),
+            'endpoints': {
+                str(webhook_id): percentiles(samples)
+                for webhook_id, samples in self.endpoint_latencies.items()
+            },
+        }
+
+class Endpoint:
+    # Per-webhook delivery lane: bounded queue, in-flight limit and circuit breaker
+    def __init__(self, webhook, queue_size, max_in_flight, breaker):
+        self.webhook_id = webhook.pk
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.max_in_flight = max_in_flight
+        self.breaker = breaker
+
+class WebhookDispatcher:
+    # Drains pending WebhookEvent rows in batches and delivers them concurrently,
+    # keeping one pooled keep-alive httpx client per endpoint host. Each webhook gets its
+    # own bounded lane so a slow or dead endpoint cannot hold up everyone else's events
+    SHED_DELAY = 30  # seconds before events shed by a full lane are offered again
+
+    def __init__(self, batch_size=500, concurrency=200, timeout=10.0,
+                 max_connections_per_host=20, transport=None,
+                 max_in_flight_per_webhook=10, queue_size_per_webhook=100,
+                 breaker_options=None):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_connections_per_host = max_connections_per_host
+        self.transport = transport
+        self.max_in_flight_per_webhook = max_in_flight_per_webhook
+        self.queue_size_per_webhook = queue_size_per_webhook
+        self.breaker_options = breaker_options or {}
+        self.clients = {}
+        self.endpoints = {}
+        self.metrics = DeliveryMetrics()
+        self.semaphore = None
+
+    def client_for(self, url):
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        client = self.clients.get(key)
+        if client is None:
+            client = self.clients[key] = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections_per_host,
+                    max_keepalive_connections=self.max_connections_per_host,
+                    keepalive_expiry=30,
+                ),
+                transport=self.transport,
+            )
+        return client
+
+    def endpoint_for(self, webhook):
+        endpoint = self.endpoints.get(webhook.pk)
+        if endpoint is None:
+            breaker = CircuitBreaker(initial_failures=webhook.failure_count, **self.breaker_options)
+            endpoint = self.endpoints[webhook.pk] = Endpoint(
+                webhook, self.queue_size_per_webhook, self.max_in_flight_per_webhook, breaker
+            )
+        return endpoint
+
+    def open_webhooks(self):
+        return [webhook_id for webhook_id, endpoint in self.endpoints.items() if endpoint.breaker.is_open()]
+
+    def encode(self, event):
+        return json.dumps(
+            {
+                'id': str(event.id),
+                'type': event.event_type,
+                'created_at': event.created_at,
+                'data': event.payload,
+            },
+            cls=DjangoJSONEncoder,
+            separators=(',', ':'),
+        ).encode()
+
+    async def deliver(self, event):
+        webhook = event.webhook
+        body = self.encode(event)
+        timestamp = str(int(time.time()))
+        headers = {
+            'Content-Type': 'application/json',
+            EVENT_HEADER: event.event_type,
+            TIMESTAMP_HEADER: timestamp,
+            SIGNATURE_HEADER: sign_payload(webhook.secret, timestamp, body),
+        }
+        attempts = event.attempts + 1
+
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.client_for(webhook.url).post(webhook.url, content=body, headers=headers)
+            except httpx.HTTPError as exc:
+                latency = time.perf_counter() - started
+                return self.failure(event, attempts, None, repr(exc), latency)
+            latency = time.perf_counter() - started
+
+        if 200 <= response.status_code < 300:
+            now = timezone.now()
+            return DeliveryResult(
+                event_id=event.pk,
+                webhook_id=webhook.pk,
+                outcome='delivered',
+                status='delivered',
+                attempts=attempts,
+                response_status=response.status_code,
+                response_body=response.text[:RESPONSE_BODY_LIMIT],
+                next_attempt_at=now,
+                delivered_at=now,
+                latency=latency,
+            )
+        return self.failure(event, attempts, response.status_code, response.text, latency)
+
+    def failure(self, event, attempts, response_status, response_body, latency):
+        exhausted = attempts >= MAX_ATTEMPTS
+        return DeliveryResult(
+            event_id=event.pk,
+            webhook_id=event.webhook_id,
+            outcome='failed' if exhausted else 'retry',
+            status='failed' if exhausted else 'pending',
+            attempts=attempts,
+            response_status=response_status,
+            response_body=response_body[:RESPONSE_BODY_LIMIT],
+            next_attempt_at=timezone.now() + timedelta(seconds=0 if exhausted else backoff_delay(attempts)),
+            delivered_at=None,
+            latency=latency,
+        )
+
+    def defer(self, event, delay):
+        # Not attempted: the event keeps its attempt count and is offered again after delay
+        return DeliveryResult(
+            event_id=event.pk,
+            webhook_id=event.webhook_id,
+            outcome='deferred',
+            status='pending',
+            attempts=event.attempts,
+            response_status=event.response_status,
+            response_body=event.response_body,
+            next_attempt_at=timezone.now() + timedelta(seconds=delay),
+            delivered_at=None,
+            latency=None,
+        )
+
+    async def run_endpoint(self, endpoint, results):
+        async def worker():
+            while True:
+                try:
+                    event = endpoint.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                self.metrics.set_queue_depth(endpoint.webhook_id, endpoint.queue.qsize())
+                if not endpoint.breaker.allow_request():
+                    result = self.defer(event, endpoint.breaker.seconds_until_retry() or self.SHED_DELAY)
+                else:
+                    result = await self.deliver(event)
+                    if result.outcome == 'delivered':
+                        endpoint.breaker.record_success(result.latency)
+                    else:
+                        endpoint.breaker.record_failure(result.latency)
+                self.metrics.observe(result)
+                results.append(result)
+
+        workers = min(endpoint.max_in_flight, endpoint.queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers)))
+
+    def enqueue(self, events, results):
+        # Route events into per-webhook lanes; open circuits and full lanes defer instead of waiting
+        lanes = {}
+        for event in events:
+            endpoint = self.endpoint_for(event.webhook)
+            if endpoint.breaker.is_open():
+                result = self.defer(event, endpoint.breaker.seconds_until_retry())
+            elif endpoint.queue.full():
+                result = self.defer(event, self.SHED_DELAY)
+            else:
+                endpoint.queue.put_nowait(event)
+                lanes[endpoint.webhook_id] = endpoint
+                continue
+            self.metrics.observe(result)
+            results.append(result)
+
+        for endpoint in lanes.values():
+            self.metrics.set_queue_depth(endpoint.webhook_id, endpoint.queue.qsize())
+        return list(lanes.values())
+
+    async def dispatch_batch(self, due_before):
+        events = await sync_to_async(claim_batch)(self.batch_size, due_before, self.open_webhooks())
+        if not events:
+            return 0
+        results = []
+        lanes = self.enqueue(events, results)
+        await asyncio.gather(*(self.run_endpoint(endpoint, results) for endpoint in lanes))
+        await sync_to_async(save_results)(results)
+        return len(results)
+
+    async def drain(self):
+        # Deliver every event due when the pass starts; retries scheduled during
+        # the pass wait for the next one. Returns the number of attempts made
+        self.semaphore = self.semaphore or asyncio.Semaphore(self.concurrency)
+        due_before = timezone.now()
+        processed = 0
+        while True:
+            count = await self.dispatch_batch(due_before)
+            if not count:
+                return processed
+            processed += count
+
+    async def aclose(self):
+        await asyncio.gather(*(client.aclose() for client in self.clients.values()))
+        self.clients.clear()
+"""
+
+"""
+# management/commands/dispatch_webhooks.py
+
+import asyncio
+import json
+from django.core.management.base import BaseCommand
+from ...webhooks import WebhookDispatcher
+
+class Command(BaseCommand):
+    help = 'Deliver pending webhook events until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--idle-sleep', type=float, default=1.0)
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(options))
+
+    async def run(self, options):
+        dispatcher = WebhookDispatcher(batch_size=options['batch_size'], concurrency=options['concurrency'])
+        try:
+            while True:
+                processed = await dispatcher.drain()
+                if processed and options['verbosity'] > 1:
+                    self.stdout.write(json.dumps(dispatcher.metrics.snapshot()))
+                if options['once']:
+                    self.stdout.write(f'{processed} delivery attempts')
+                    return
+                if not processed:
+                    await asyncio.sleep(options['idle_sleep'])
+        finally:
+            await dispatcher.aclose()
+"""
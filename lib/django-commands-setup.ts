@@ -83,10 +83,12 @@ LOCAL_APPS = [
 INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 
 MIDDLEWARE = [
+    'subchain.instrumentation.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'subchain.throttling.RateLimitHeadersMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -122,6 +124,11 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD', 'password'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Une connexion par requête (et par thread de gather_queries), rendue à PgBouncer en
+        # mode session (pool_mode = session). Les curseurs serveur (iterator(), aiterator())
+        # ne survivent pas au mode transaction, et les désactiver ferait tout charger en mémoire.
+        'CONN_MAX_AGE': 0,
+        'DISABLE_SERVER_SIDE_CURSORS': False,
     }
 }
 
@@ -139,6 +146,25 @@ CACHES = {
     }
 }
 
+# Per-user response cache (plans, analytics); must be shared by every worker process
+SUBCHAIN_RESPONSE_CACHE_BACKEND = 'subchain.cache.RedisBackend'
+
+# Token-bucket rate limits per API key (or user), by plan_tier
+SUBCHAIN_THROTTLE_BACKEND = 'subchain.throttling.RedisTokenBucketBackend'
+SUBCHAIN_THROTTLE_RATES = {
+    'anonymous': '30/min',
+    'starter': '60/min',
+    'pro': '600/min',
+    'enterprise': '6000/min',
+}
+
+# Request metrics (the 'metrics' route, refused while METRICS_TOKEN is unset) and sampled
+# profiling of slow requests
+SUBCHAIN_METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+SUBCHAIN_PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+SUBCHAIN_PROFILE_SLOW_SECONDS = 1.0
+SUBCHAIN_PROFILE_DIR = BASE_DIR / 'profiles'
+
 # Celery Configuration
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
@@ -147,6 +173,34 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Tâches périodiques
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-plan-counters': {
+        'task': 'plans.reconcile_counters',
+        'schedule': timedelta(minutes=15),
+    },
+    'reconcile-metrics-snapshots': {
+        'task': 'analytics.reconcile_snapshots',
+        'schedule': timedelta(minutes=15),
+    },
+    'run-billing-cycle': {
+        'task': 'billing.run_cycle',
+        'schedule': timedelta(hours=1),
+    },
+    'reconcile-chain-payments': {
+        'task': 'payments.reconcile_chain',
+        'schedule': timedelta(seconds=30),
+    },
+    'compact-payment-ledger': {
+        'task': 'ledger.compact',
+        'schedule': timedelta(minutes=1),
+    },
+    'archive-old-rows': {
+        'task': 'archive.run',
+        'schedule': timedelta(hours=6),
+    },
+}
+
 # Custom User Model
 AUTH_USER_MODEL = 'accounts.User'
 
@@ -179,17 +233,34 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Cold storage for archived payments and webhook events (archive.py); point the 'archive'
+# alias at an object store (django-storages) in production
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'archive': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': os.path.join(BASE_DIR, 'archive')},
+    },
+}
+SUBCHAIN_ARCHIVE_STORAGE = 'archive'
+SUBCHAIN_ARCHIVE_RETENTION_DAYS = {'payment': 365, 'webhook_event': 90}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'subchain.authentication.ClaimsJWTAuthentication',
+        'subchain.authentication.APIKeyAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'subchain.throttling.PlanTierThrottle',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': [
@@ -237,6 +308,9 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'noreply@subchain.com')
 ALGORAND_NODE_URL = os.getenv('ALGORAND_NODE_URL', 'https://testnet-api.algonode.cloud')
 ALGORAND_INDEXER_URL = os.getenv('ALGORAND_INDEXER_URL', 'https://testnet-idx.algonode.cloud')
 ALGORAND_NETWORK = os.getenv('ALGORAND_NETWORK', 'testnet')
+ALGORAND_INDEXER_TOKEN = os.getenv('ALGORAND_INDEXER_TOKEN', '')
+# USDC ASA: 10458941 on testnet, 31566704 on mainnet
+ALGORAND_USDC_ASSET_ID = int(os.getenv('ALGORAND_USDC_ASSET_ID', '10458941'))
 
 # Currency API Configuration
 COINGECKO_API_KEY = os.getenv('COINGECKO_API_KEY')
@@ -279,6 +353,7 @@ LOGGING = {
 Django>=4.2.0
 djangorestframework>=3.14.0
 djangorestframework-simplejwt>=5.2.0
+adrf>=0.1.6
 django-cors-headers>=4.0.0
 django-filter>=23.0.0
 drf-spectacular>=0.26.0
@@ -296,6 +371,12 @@ redis>=4.5.0
 # Algorand SDK
 py-algorand-sdk>=2.0.0
 
+# Livraison des webhooks
+httpx>=0.27.0
+
+# Analytics (cohortes)
+numpy>=1.26.0
+
 # Utilitaires
 python-decouple>=3.8
 Pillow>=10.0.0
@@ -310,6 +391,7 @@ coverage>=7.0.0
 
 # Production
 gunicorn>=21.0.0
+uvicorn[standard]>=0.23.0
 whitenoise>=6.5.0
 sentry-sdk>=1.32.0
 `,
@@ -432,7 +514,21 @@ celery -A subchain_backend flower
 celery -A subchain_backend purge
 `,
 
-  // 9. Structure des dossiers
+  // 9. Serveurs d'application
+  SERVER_COMMANDS: `
+# WSGI : un thread de worker par requête en cours, vues synchrones
+gunicorn subchain_backend.wsgi:application --workers 4 --threads 8
+
+# ASGI : vues async (analytics/overview/async/, plans/stream/, subscribers/stream/) sur la boucle d'événements
+# Garder CONN_MAX_AGE à 0 et placer PgBouncer devant PostgreSQL, en mode session
+# (pool_mode = session dans pgbouncer.ini) : les flux lisent via un curseur serveur
+gunicorn subchain_backend.asgi:application --workers 4 -k uvicorn.workers.UvicornWorker
+
+# Comparer les deux déploiements sous charge concurrente
+python manage.py benchmark_api --workloads plan_list --deployments --scenarios plan_stream --concurrency 256 --threads 8
+`,
+
+  // 10. Structure des dossiers
   FOLDER_STRUCTURE: `
 subchain_backend/
 ├── manage.py
@@ -443,6 +539,7 @@ subchain_backend/
 │   ├── settings.py
 │   ├── urls.py
 │   ├── wsgi.py
+│   ├── asgi.py
 │   └── celery.py
 ├── accounts/
 │   ├── models.py